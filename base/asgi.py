@@ -0,0 +1,20 @@
+"""
+ASGI config for base project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+run it with any ASGI server, e.g. ``uvicorn base.asgi:application``.
+
+Django 2.2 views are synchronous: shop.asgi.ASGIHandler reads requests and
+writes responses on the event loop and runs the views in a pool of
+SHOP_ASGI_WORKERS threads.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'base.settings')
+
+from shop.asgi import ASGIHandler  # noqa: E402  settings first
+
+application = ASGIHandler(get_wsgi_application())
@@ -44,11 +44,13 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'shop.middleware.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'shop.routers.StickyPrimaryMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -68,22 +70,83 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media',
+                'shop.context_processors.account',
             ],
         },
     },
 ]
 
+# SHOP_TEMPLATES=production parses every template once per process (cached
+# loaders), debug (default) reads them from disk again on every render, so
+# edits show up without a restart
+SHOP_TEMPLATES = os.environ.get('SHOP_TEMPLATES', 'debug')
+if SHOP_TEMPLATES == 'production':
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'base.wsgi.application'
 
+# threads running views behind base.asgi, the event loop handles slow clients
+SHOP_ASGI_WORKERS = int(os.environ.get('SHOP_ASGI_WORKERS', 8))
+
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+# DB_ENGINE=postgresql for production, sqlite (default) for development.
+# DB_POOLER=pgbouncer when HOST/PORT point at pgbouncer in transaction mode
+
+SQLITE_DATABASE = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.environ.get('SQLITE_PATH', os.path.join(BASE_DIR, 'db.sqlite3')),
+    # seconds a writer waits for the lock instead of failing at once
+    'OPTIONS': {'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20))},
 }
+# SQLITE_WAL=1 switches SQLite files to WAL (shop.db), readers then don't wait
+# for a writer. The mode sticks to the file, db.sqlite3 in git is left alone
+SHOP_SQLITE_WAL = os.environ.get('SQLITE_WAL') == '1'
+
+if os.environ.get('DB_ENGINE', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'shop'),
+            'USER': os.environ.get('DB_USER', 'shop'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # persistent connections, reused across requests of a worker
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            # transaction pooling can't keep server side cursors between queries
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER') == 'pgbouncer',
+        },
+        # old development database, source of 'manage.py copy_shop_data'
+        'sqlite': SQLITE_DATABASE,
+    }
+else:
+    DATABASES = {
+        'default': SQLITE_DATABASE,
+    }
+
+# read replicas for list, search and report views (shop.routers).
+# DB_REPLICA_HOSTS=host1,host2 for PostgreSQL streaming replicas, or for
+# development SQLITE_REPLICA_PATH, a copy of the SQLite file refreshed by
+# 'manage.py sync_sqlite_replica'. Tests read the primary through them
+if os.environ.get('DB_ENGINE', 'sqlite') == 'postgresql':
+    for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+        DATABASES[f'replica{number}'] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+elif os.environ.get('SQLITE_REPLICA_PATH'):
+    DATABASES['replica1'] = dict(SQLITE_DATABASE, NAME=os.environ['SQLITE_REPLICA_PATH'],
+                                 TEST={'MIRROR': 'default'})
+
+SHOP_DB_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')]
+DATABASE_ROUTERS = ['shop.routers.PrimaryReplicaRouter']
+# seconds a session reads the primary after it wrote, longer than the replica lag
+SHOP_REPLICA_STICKY_SECONDS = int(os.environ.get('SHOP_REPLICA_STICKY_SECONDS', 10))
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -137,6 +200,10 @@ USE_TZ = True
 MEDIA_ROOT = os.path.join(BASE_DIR, 'files', 'media')
 MEDIA_URL = '/media/'
 
+# resized product photos are made by a worker pool, SYNC makes them in request
+SHOP_IMAGE_WORKERS = int(os.environ.get('SHOP_IMAGE_WORKERS', 2))
+SHOP_IMAGE_SYNC = False
+
 STATIC_ROOT = os.path.join(BASE_DIR, 'files', 'asset')
 
 STATIC_URL = '/static/'
@@ -148,6 +215,75 @@ STATICFILES_FINDERS = (
     'django.contrib.staticfiles.finders.AppDirectoriesFinder',
 )
 
+# production assets: SHOP_ASSETS=production, then run collectstatic.
+# Static names get content hashes, .gz/.br copies are made next to them and
+# Django serves files/asset and files/media with long Cache-Control and ETag
+SHOP_ASSETS = os.environ.get('SHOP_ASSETS', 'debug')
+if SHOP_ASSETS == 'production':
+    STATICFILES_STORAGE = 'shop.storage.CompressedManifestStaticFilesStorage'
+
 LOGIN_REDIRECT_URL = '/'
 
+""" cache and session settings """
+
+# SHOP_CACHE=file shares the cache (and cache sessions) between the worker
+# processes of one host, locmem (default) is private to every process.
+# Sessions get their own cache, so catalogue churn never culls a login
+SHOP_CACHE = os.environ.get('SHOP_CACHE', 'locmem')
+SHOP_CACHE_PATH = os.environ.get('SHOP_CACHE_PATH', os.path.join(BASE_DIR, 'files', 'cache'))
+SESSION_CACHE_ALIAS = 'sessions'
+
+if SHOP_CACHE == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(SHOP_CACHE_PATH, 'default'),
+        },
+        SESSION_CACHE_ALIAS: {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(SHOP_CACHE_PATH, 'sessions'),
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'shop',
+        },
+        SESSION_CACHE_ALIAS: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'shop-sessions',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+
+# SHOP_SESSIONS picks where logins live:
+#   cached_db (default) reads from the sessions cache, writes through to django_session
+#   cache keeps them in the sessions cache only, a cache restart logs everybody out
+#   signed_cookies keeps them in the browser, no server storage, can't be revoked
+#   db reads django_session on every request
+SHOP_SESSIONS = os.environ.get('SHOP_SESSIONS', 'cached_db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SHOP_SESSIONS}'
+
+# flash messages ride in a signed cookie, never in the session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# seconds between in-process runs of the return expiry, unset when cron runs
+# 'manage.py expire_returns' instead
+SHOP_RETURN_EXPIRY_INTERVAL = int(os.environ.get('SHOP_RETURN_EXPIRY_INTERVAL', 0)) or None
+# seconds a cart hold keeps stock for a buyer, and between in-process runs of
+# the hold expiry (unset when cron runs 'manage.py expire_holds' instead)
+SHOP_HOLD_TTL = int(os.environ.get('SHOP_HOLD_TTL', 10 * 60))
+SHOP_HOLD_EXPIRY_INTERVAL = int(os.environ.get('SHOP_HOLD_EXPIRY_INTERVAL', 0)) or None
+# seconds a purchase/return idempotency key is remembered, 'manage.py purge_idempotency_keys'
+SHOP_IDEMPOTENCY_TTL = int(os.environ.get('SHOP_IDEMPOTENCY_TTL', 24 * 60 * 60))
+
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
+
+""" metrics settings """
+
+# requests of shop views running more queries are logged as N+1 suspects
+SHOP_QUERY_BUDGET = int(os.environ.get('SHOP_QUERY_BUDGET', 20))
+# bearer token for Prometheus scrapes of /metrics/, superusers need none
+SHOP_METRICS_TOKEN = os.environ.get('SHOP_METRICS_TOKEN')
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from shop import models
+
+SUMMARY_FIELDS = ('cash', 'purchase_count', 'total_spent', 'pending_returns')
+SUMMARY_TIMEOUT = getattr(settings, 'SHOP_ACCOUNT_SUMMARY_TIMEOUT', 60 * 60)
+
+
+def _key(user_id):
+    return f'account:summary:{user_id}'
+
+
+def summary(user_id):
+    """ cash, purchase_count, total_spent, pending_returns of user """
+
+    data = cache.get(_key(user_id))
+    if data is None:
+        data = (models.Profile.objects
+                .filter(user_id=user_id)
+                .values(*SUMMARY_FIELDS)
+                .first())
+        if data is None:
+            return None
+        cache.set(_key(user_id), data, SUMMARY_TIMEOUT)
+    return data
+
+
+def rebuild(user_ids=None):
+    """ recount purchase_count, total_spent and pending_returns from history """
+
+    purchases = models.Purchase.objects.all()
+    if user_ids is not None:
+        purchases = purchases.filter(buyer_id__in=user_ids)
+    totals = (purchases.values('buyer_id')
+              .annotate(purchases=Count('pk'),
+                        spent=Sum(ExpressionWrapper(F('count') * F('product__price'),
+                                                    output_field=DecimalField())),
+                        pending=Count('purchase')))
+
+    with transaction.atomic():
+        profiles = models.Profile.objects.all()
+        if user_ids is not None:
+            profiles = profiles.filter(user_id__in=user_ids)
+        profiles.update(purchase_count=0, total_spent=0, pending_returns=0)
+        for row in totals.iterator():
+            models.Profile.objects.filter(user_id=row['buyer_id']).update(
+                purchase_count=row['purchases'], total_spent=row['spent'], pending_returns=row['pending'])
+    cache.delete_many([_key(pk) for pk in profiles.values_list('user_id', flat=True)])
+
+
+def invalidate(*user_ids):
+    """ drop cached summaries now and again when the transaction commits,
+    so a concurrent reader can't cache the pre-commit values """
+
+    keys = [_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(post_save, sender=models.Profile)
+def profile_saved(sender, instance, **kwargs):
+    invalidate(instance.user_id)
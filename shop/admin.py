@@ -1,7 +1,118 @@
-from django.contrib import admin
-from .models import Profile, Purchase, Product, Return
+from django.contrib import admin, messages
+from django.db import transaction
+from django.db.models import F
 
-admin.site.register(Profile)
-admin.site.register(Purchase)
-admin.site.register(Product)
-admin.site.register(Return)
\ No newline at end of file
+from shop import catalogue
+from shop import holds
+from shop import ledger
+from shop import returns
+from .models import LedgerEvent, Profile, Purchase, Product, Return, StockHold
+
+RESTOCK_AMOUNTS = (10, 100)
+
+
+class ShopAdmin(admin.ModelAdmin):
+    """ changelists stay cheap on big tables: no full COUNT(*), joins instead of per row queries """
+
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(Profile)
+class ProfileAdmin(ShopAdmin):
+    list_display = ('user', 'cash', 'purchase_count', 'total_spent', 'pending_returns')
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    autocomplete_fields = ('user',)
+    # account summary is kept by shop.checkout and shop.returns
+    readonly_fields = ('purchase_count', 'total_spent', 'pending_returns')
+
+
+def restock_action(amount):
+    def restock(modeladmin, request, queryset):
+        pks = list(queryset.values_list('pk', flat=True))
+        with transaction.atomic():
+            Product.objects.filter(pk__in=pks).update(count=F('count') + amount)
+            ledger.record([LedgerEvent(kind=LedgerEvent.RESTOCK, product_id=pk, stock_delta=amount)
+                           for pk in pks])
+            transaction.on_commit(lambda: [catalogue.invalidate_product(pk) for pk in pks])
+        modeladmin.message_user(request, f'{len(pks)} products restocked by {amount}', messages.SUCCESS)
+
+    restock.__name__ = f'restock_{amount}'
+    restock.short_description = f'Add {amount} to stock of selected products'
+    return restock
+
+
+@admin.register(Product)
+class ProductAdmin(ShopAdmin):
+    list_display = ('pk', 'name', 'price', 'count', 'reserved', 'return_window')
+    list_display_links = ('pk', 'name')
+    search_fields = ('name',)
+    actions = [restock_action(amount) for amount in RESTOCK_AMOUNTS]
+
+
+@admin.register(Purchase)
+class PurchaseAdmin(ShopAdmin):
+    list_display = ('pk', 'time', 'buyer', 'product', 'count', 'return_state', 'return_deadline')
+    list_select_related = ('buyer', 'product')
+    autocomplete_fields = ('buyer', 'product')
+    list_filter = ('return_state', 'time')
+    date_hierarchy = 'time'
+    ordering = ('-time', '-pk')
+    actions = ['refund']
+
+    def refund(self, request, queryset):
+        rows = returns.refund(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f'Refunded {len(rows)} purchases: '
+                                   f'{sum(row["total"] for row in rows)} ₴', messages.SUCCESS)
+
+    refund.short_description = 'Refund and restock selected purchases'
+
+
+@admin.register(Return)
+class ReturnAdmin(ShopAdmin):
+    list_display = ('purchase_id', 'post_time', 'buyer', 'product', 'count')
+    list_select_related = ('purchase__buyer', 'purchase__product')
+    raw_id_fields = ('purchase',)
+    ordering = ('post_time', 'pk')
+    actions = ['approve', 'reject']
+
+    def buyer(self, obj):
+        return obj.purchase.buyer.username
+
+    def product(self, obj):
+        return obj.purchase.product.name
+
+    def count(self, obj):
+        return obj.purchase.count
+
+    def approve(self, request, queryset):
+        rows = returns.approve(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f'Return in store confirmed: {len(rows)} purchases. '
+                                   f'Return {sum(row["total"] for row in rows)} ₴', messages.SUCCESS)
+
+    approve.short_description = 'Refund and restock selected returns'
+
+    def reject(self, request, queryset):
+        rows = returns.reject(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f'{len(rows)} purchases left with the buyers', messages.SUCCESS)
+
+    reject.short_description = 'Reject selected returns'
+
+
+@admin.register(StockHold)
+class StockHoldAdmin(ShopAdmin):
+    list_display = ('pk', 'user', 'product', 'count', 'expires')
+    list_select_related = ('user', 'product')
+    raw_id_fields = ('user', 'product')
+    ordering = ('expires', 'pk')
+    actions = ['release']
+
+    def has_add_permission(self, request):
+        return False  # reserved stock is kept by shop.holds
+
+    def release(self, request, queryset):
+        rows = holds.release(StockHold.objects.filter(pk__in=list(queryset.values_list('pk', flat=True))))
+        self.message_user(request, f'{len(rows)} holds released', messages.SUCCESS)
+
+    release.short_description = 'Give the stock of selected holds back'
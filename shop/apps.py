@@ -1,5 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ShopConfig(AppConfig):
     name = 'shop'
+
+    def ready(self):
+        from shop import account, catalogue, db, images, ledger, search  # noqa: F401 connect signal receivers
+
+        interval = getattr(settings, 'SHOP_RETURN_EXPIRY_INTERVAL', None)
+        if interval:
+            from shop import returns
+            returns.start_expiry(interval)
+
+        interval = getattr(settings, 'SHOP_HOLD_EXPIRY_INTERVAL', None)
+        if interval:
+            from shop import holds
+            holds.start_expiry(interval)
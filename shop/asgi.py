@@ -0,0 +1,124 @@
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+
+# Django 2.2 has no ASGI support of its own: this adapter keeps slow clients
+# on the event loop (request body, response writes) and only borrows a
+# thread from a bounded pool while the WSGI handler runs the view
+
+HEADER_ENVIRON = {b'content-type': 'CONTENT_TYPE', b'content-length': 'CONTENT_LENGTH'}
+
+
+def environ(scope, body):
+    """ WSGI environ of an ASGI http scope, body is a binary file """
+
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name):]
+
+    result = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('127.0.0.1', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        key = HEADER_ENVIRON.get(name.lower()) or 'HTTP_' + name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key in result:
+            value = result[key] + (';' if key == 'HTTP_COOKIE' else ',') + value
+        result[key] = value
+    return result
+
+
+class ASGIHandler:
+    """ ASGI application running a WSGI application in a bounded thread pool """
+
+    def __init__(self, wsgi_application, workers=None):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or getattr(settings, 'SHOP_ASGI_WORKERS', 8),
+            thread_name_prefix='shop-asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(f"unsupported ASGI scope type {scope['type']}")
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        body = SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body
+
+    def start(self, wsgi_environ):
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+
+        chunks = self.wsgi_application(wsgi_environ, start_response)
+        return started, chunks
+
+    async def http(self, scope, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            started, chunks = await loop.run_in_executor(self.executor, self.start, environ(scope, body))
+        finally:
+            body.close()
+
+        try:
+            await send({'type': 'http.response.start',
+                        'status': started['status'], 'headers': started['headers']})
+            iterator = iter(chunks)
+            while True:
+                # single chunk for plain responses, lazy for file/streaming ones
+                chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # fires request_finished, which closes stale DB connections
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(self.executor, chunks.close)
@@ -0,0 +1,66 @@
+import mimetypes
+import os
+import re
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+# manifest hashed static files and content hashed photo variants never change
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[\w.]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=3600'
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _accepted_encodings(request):
+    accept = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    return {part.split(';')[0].strip() for part in accept.split(',')}
+
+
+def _etag(stat):
+    return quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
+
+@require_safe
+def serve(request, path, document_root):
+    """ static/media file with ETag, far-future Cache-Control for hashed
+    names and precompressed .br/.gz copies when the client accepts them """
+
+    try:
+        fullpath = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    if not os.path.isfile(fullpath):
+        raise Http404('Not found')
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    served_path, content_encoding = fullpath, encoding
+    if encoding is None:
+        accepted = _accepted_encodings(request)
+        for name, extension in ENCODINGS:
+            if name in accepted and os.path.isfile(fullpath + extension):
+                served_path, content_encoding = fullpath + extension, name
+                break
+
+    stat = os.stat(served_path)
+    etag = _etag(stat)
+    cache_control = IMMUTABLE if HASHED_NAME.search(path) else REVALIDATE
+
+    if etag in (tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(served_path, 'rb'),
+                                content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = stat.st_size
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    response['Vary'] = 'Accept-Encoding'
+    return response
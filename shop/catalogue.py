@@ -0,0 +1,144 @@
+import hashlib
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.middleware.csrf import get_token
+from django.template import engines
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from shop import forms
+from shop import models
+from shop import routers
+
+CARD_TEMPLATE = 'shop/product/card.html'
+PAGE_TIMEOUT = getattr(settings, 'SHOP_CATALOGUE_PAGE_TIMEOUT', 5 * 60)
+CARD_TIMEOUT = getattr(settings, 'SHOP_CATALOGUE_CARD_TIMEOUT', 24 * 60 * 60)
+
+# per request values are rendered as placeholders and substituted on output
+CSRF_PLACEHOLDER = '__shop_csrf_token__'
+PATH_PLACEHOLDER = '__shop_full_path__'
+IDEMPOTENCY_PLACEHOLDER = '__shop_idempotency_key__'
+
+ROLES = {
+    'anonymous': {'is_authenticated': False, 'is_superuser': False},
+    'buyer': {'is_authenticated': True, 'is_superuser': False},
+    'superuser': {'is_authenticated': True, 'is_superuser': True},
+}
+
+Card = namedtuple('Card', ['pk', 'html'])
+
+
+def user_role(user):
+    if not user.is_authenticated:
+        return 'anonymous'
+    return 'superuser' if user.is_superuser else 'buyer'
+
+
+def _version(key):
+    # a missing counter restarts from the clock, never from an old value
+    return cache.get_or_set(key, time.time_ns(), None)
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def catalogue_version():
+    return _version('catalogue:version')
+
+
+def invalidate_product(pk):
+    """ drop cached card of product and every cached page slice """
+
+    _bump(f'catalogue:product:{pk}:version')
+    _bump('catalogue:version')
+
+
+def page_key(*params):
+    params = hashlib.md5(':'.join(str(param) for param in params).encode()).hexdigest()
+    return f'catalogue:page:{catalogue_version()}:{params}'
+
+
+def get_page(key):
+    return cache.get(key)
+
+
+def set_page(key, data):
+    timeout = PAGE_TIMEOUT
+    if not routers.reading_primary():
+        # a slice read on a lagging replica may miss the change that bumped the version
+        timeout = min(timeout, routers.sticky_seconds())
+    cache.set(key, data, timeout)
+
+
+def _card_key(pk, version, role):
+    return f'catalogue:card:{pk}:{version}:{role}'
+
+
+def render_cards(products, role, engine=None):
+    """ {pk: card html} of products for role. The template is looked up once
+    for all of them, not once per card (a disk read without cached loaders) """
+
+    template = (engine or engines['django']).get_template(CARD_TEMPLATE)
+    context = {
+        'user': ROLES[role],
+        'MEDIA_URL': settings.MEDIA_URL,
+        'csrf_token': CSRF_PLACEHOLDER,
+        'success_url': PATH_PLACEHOLDER,
+        'idempotency_key': IDEMPOTENCY_PLACEHOLDER,
+        'purchase_create_form': forms.PurchaseCreateForm,
+    }
+    return {product.pk: template.render(dict(context, product=product)) for product in products}
+
+
+def cards(request, pks, products=None):
+    """ rendered cards for product pks in order. Only products missing in
+    cache are loaded, with one query, unless `products` are already at hand """
+
+    role = user_role(request.user)
+    version_keys = [f'catalogue:product:{pk}:version' for pk in pks]
+    versions = cache.get_many(version_keys)
+    for key in version_keys:
+        if key not in versions:
+            versions[key] = _version(key)
+    card_keys = {pk: _card_key(pk, versions[key], role) for pk, key in zip(pks, version_keys)}
+    cached = cache.get_many(card_keys.values())
+    html = {pk: cached.get(key) for pk, key in card_keys.items()}
+
+    missing = [pk for pk, fragment in html.items() if fragment is None]
+    if missing:
+        loaded = {product.pk: product for product in products or ()}
+        # cards live until the product changes, never render one from a replica
+        if not all(pk in loaded for pk in missing) or not routers.reading_primary():
+            loaded = models.Product.objects.using(DEFAULT_DB_ALIAS).in_bulk(missing)
+        rendered = render_cards([loaded[pk] for pk in missing if pk in loaded], role)
+        cache.set_many({card_keys[pk]: fragment for pk, fragment in rendered.items()}, CARD_TIMEOUT)
+        html.update(rendered)
+
+    result = []
+    for pk in pks:
+        fragment = html.get(pk)
+        if fragment is None:
+            continue  # deleted after the page slice was cached
+        if role == 'buyer':
+            fragment = (fragment.replace(CSRF_PLACEHOLDER, get_token(request))
+                        .replace(PATH_PLACEHOLDER, escape(request.get_full_path()))
+                        .replace(IDEMPOTENCY_PLACEHOLDER, uuid.uuid4().hex))
+        result.append(Card(pk, mark_safe(fragment)))
+    return result
+
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_delete, sender=models.Product)
+def product_changed(sender, instance, **kwargs):
+    invalidate_product(instance.pk)
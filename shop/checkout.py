@@ -0,0 +1,138 @@
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from shop import account
+from shop import catalogue
+from shop import idempotency
+from shop import ledger
+from shop import models
+from shop import stats
+
+
+class CheckoutError(Exception):
+    """ purchase rejected, nothing was written """
+
+    def __init__(self, status, product, count, total_cost=None):
+        super().__init__(status)
+        self.status = status
+        self.product = product
+        self.count = count
+        self.total_cost = total_cost
+
+
+class SoldOut(CheckoutError):
+    """ not enough product in stock """
+
+    def __init__(self, product, count):
+        super().__init__('sold_out', product, count)
+
+
+class InsufficientFunds(CheckoutError):
+    """ not enough cash on buyer profile """
+
+    def __init__(self, product, count, total_cost):
+        super().__init__('insufficient_funds', product, count, total_cost)
+
+
+def purchase(user, product_pk, count, idempotency_key=None):
+    """ buy `count` items of one product, see purchase_many """
+
+    return purchase_many(user, [(product_pk, count)], idempotency_key)[0]
+
+
+def purchase_many(user, lines, idempotency_key=None):
+    """ buy many (product_pk, count) lines for user in one transaction.
+
+    Stock and cash are decremented with conditional UPDATE ... WHERE
+    statements, so two buyers racing for the same row can not both win:
+    the loser matches fewer rows and the whole transaction is rolled back.
+    Costs a fixed number of queries for any number of lines.
+    Returns created Purchase list, raises SoldOut or InsufficientFunds,
+    or idempotency.AlreadyProcessed when idempotency_key was used before.
+    ValueError for no lines or counts below one, before anything is written.
+    """
+
+    ordered = {}
+    for product_pk, count in lines:
+        if count < 1:
+            raise ValueError(f'count of product {product_pk} must be positive, not {count}')
+        ordered[product_pk] = ordered.get(product_pk, 0) + count
+    if not ordered:
+        raise ValueError('nothing to purchase')
+
+    try:
+        with transaction.atomic():
+            return _purchase(user, ordered, idempotency_key)
+    except _OutOfStock:
+        raise shortage(ordered)
+
+
+class _OutOfStock(Exception):
+    pass
+
+
+def shortage(ordered):
+    """ SoldOut (or Product.DoesNotExist) for the first of ordered {pk: count}
+    lines that is not available, after the stock update was rolled back """
+
+    products = (models.Product.objects
+                .only('pk', 'name', 'price', 'count', 'reserved')
+                .in_bulk(list(ordered)))
+    missing = set(ordered) - set(products)
+    if missing:
+        return models.Product.DoesNotExist(f'Product {sorted(missing)} does not exist')
+    short = [pk for pk, count in ordered.items() if products[pk].available < count] or list(ordered)
+    return SoldOut(products[short[0]], ordered[short[0]])
+
+
+def _purchase(user, ordered, idempotency_key):
+    idempotency.claim(user.pk, idempotency_key)
+
+    # write first: the UPDATE takes the row locks (and SQLite's write lock,
+    # which a transaction that has already read can't wait for).
+    # Units held for other buyers are not for sale
+    in_stock = Q()
+    for pk, count in ordered.items():
+        in_stock |= Q(pk=pk, count__gte=F('reserved') + count)
+    stock_updated = (models.Product.objects
+                     .filter(in_stock)
+                     .update(count=Case(*[When(pk=pk, then=F('count') - count)
+                                          for pk, count in ordered.items()],
+                                        default=F('count'))))
+    if stock_updated != len(ordered):
+        raise _OutOfStock
+    return charge(user, ordered)
+
+
+def charge(user, ordered):
+    """ second half of a purchase, in the caller's transaction: the stock of
+    ordered {pk: count} is already taken, charge user, record the sale and
+    create the Purchase rows. Raises InsufficientFunds """
+
+    products = (models.Product.objects
+                .only('pk', 'name', 'price', 'count', 'reserved', 'return_window')
+                .in_bulk(list(ordered)))
+    total_cost = sum(products[pk].price * count for pk, count in ordered.items())
+
+    cash_updated = (models.Profile.objects
+                    .filter(user_id=user.pk, cash__gt=total_cost)
+                    .update(cash=F('cash') - total_cost,
+                            total_spent=F('total_spent') + total_cost,
+                            purchase_count=F('purchase_count') + len(ordered)))
+    if not cash_updated:
+        pk = next(iter(ordered))
+        raise InsufficientFunds(products[pk], ordered[pk], total_cost)
+    account.invalidate(user.pk)
+    stats.record_sales((user.pk, pk, count, products[pk].price * count) for pk, count in ordered.items())
+    ledger.record([models.LedgerEvent(kind=models.LedgerEvent.PURCHASE, user_id=user.pk, product_id=pk,
+                                      stock_delta=-count, cash_delta=-products[pk].price * count)
+                   for pk, count in ordered.items()])
+
+    transaction.on_commit(lambda: [catalogue.invalidate_product(pk) for pk in ordered])
+    now = timezone.now()
+    return models.Purchase.objects.bulk_create([
+        models.Purchase(buyer_id=user.pk, product=products[pk], count=count,
+                        return_deadline=now + products[pk].return_window)
+        for pk, count in ordered.items()
+    ])
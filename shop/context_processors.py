@@ -0,0 +1,12 @@
+from django.utils.functional import SimpleLazyObject
+
+from shop import account as account_summary
+
+
+def account(request):
+    """ 'account' summary of the current buyer, read from cache on use """
+
+    user = request.user
+    if not user.is_authenticated or user.is_superuser:
+        return {'account': None}
+    return {'account': SimpleLazyObject(lambda: account_summary.summary(user.pk))}
@@ -0,0 +1,21 @@
+import os
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """ WAL lets readers work while one writer commits, with SHOP_SQLITE_WAL.
+    The journal mode is stored in the file, the tracked development database
+    is never converted """
+
+    if connection.vendor != 'sqlite' or not getattr(settings, 'SHOP_SQLITE_WAL', False):
+        return
+    name = connection.settings_dict['NAME']
+    if name == ':memory:' or os.path.abspath(name) == os.path.join(settings.BASE_DIR, 'db.sqlite3'):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
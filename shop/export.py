@@ -0,0 +1,92 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from shop import models
+
+CHUNK_SIZE = 2000
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+# kind -> (model, time field for the date range, buyer field, column -> field path)
+EXPORTS = {
+    'purchases': (models.Purchase, 'time', 'buyer', {
+        'purchase_id': 'pk',
+        'time': 'time',
+        'buyer_id': 'buyer_id',
+        'username': 'buyer__username',
+        'product_id': 'product_id',
+        'product_name': 'product__name',
+        'count': 'count',
+        'price': 'product__price',
+        'return_status': 'return_status',
+        'return_state': 'return_state',
+        'return_deadline': 'return_deadline',
+    }),
+    'returns': (models.Return, 'post_time', 'purchase__buyer', {
+        'purchase_id': 'pk',
+        'post_time': 'post_time',
+        'time': 'purchase__time',
+        'buyer_id': 'purchase__buyer_id',
+        'username': 'purchase__buyer__username',
+        'product_id': 'purchase__product_id',
+        'product_name': 'purchase__product__name',
+        'count': 'purchase__count',
+        'price': 'purchase__product__price',
+    }),
+}
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rows(kind, since=None, until=None, buyer=None, chunk_size=CHUNK_SIZE, using=DEFAULT_DB_ALIAS):
+    """ values() dicts of kind ('purchases' or 'returns') in pk order.
+    since/until are dates (both included), buyer a username. Rows are fetched
+    chunk_size at a time (server side cursor on PostgreSQL), never all at once.
+    The stream outlives the view, so the database (a replica) is given as using """
+
+    model, time_field, buyer_field, columns = EXPORTS[kind]
+    queryset = model.objects.using(using)
+    if since:
+        queryset = queryset.filter(**{f'{time_field}__gte': _day_start(since)})
+    if until:
+        queryset = queryset.filter(**{f'{time_field}__lt': _day_start(until + timedelta(days=1))})
+    if buyer:
+        queryset = queryset.filter(**{f'{buyer_field}__username': buyer})
+    names = list(columns)
+    for values in (queryset.order_by('pk')
+                   .values_list(*columns.values())
+                   .iterator(chunk_size=chunk_size)):
+        yield dict(zip(names, values))
+
+
+class _Echo:
+    """ file-like object handing back what csv.writer writes """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(kind, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(list(EXPORTS[kind][3]))
+    for row in rows:
+        yield writer.writerow(row.values())
+
+
+def jsonl_lines(kind, rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def lines(kind, export_format, **filters):
+    """ text lines of the export, header first for csv. filters go to rows() """
+
+    encode = csv_lines if export_format == 'csv' else jsonl_lines
+    return encode(kind, rows(kind, **filters))
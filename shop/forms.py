@@ -1,5 +1,8 @@
-from django.forms import ModelForm
-from .models import Product, Purchase, Return
+from django.core.exceptions import ValidationError
+from django.forms import BooleanField, CharField, ChoiceField, DateField, Form, HiddenInput, IntegerField, ModelForm
+from .export import FORMATS
+from .search import PRICE_RANGES
+from .models import Product, Purchase
 
 
 class ProductCreateForm(ModelForm):
@@ -14,7 +17,57 @@ class PurchaseCreateForm(ModelForm):
         fields = ['count', ]
 
 
-class ReturnCreateForm(ModelForm):
-    class Meta:
-        model = Return
-        fields = ['purchase', ]
+class ReturnCreateForm(Form):
+    """ purchase pk only, the row is looked up by ReturnCreate """
+
+    purchase = IntegerField(min_value=1, widget=HiddenInput)
+
+
+class CartCheckoutForm(Form):
+    """ cart lines as repeated fields: product=1&count=2&product=5&count=1 """
+
+    max_lines = 100
+
+    def clean(self):
+        products = self.data.getlist('product')
+        counts = self.data.getlist('count')
+
+        if not products or len(products) != len(counts):
+            raise ValidationError('Cart needs product and count for every line')
+        if len(products) > self.max_lines:
+            raise ValidationError(f'Cart can hold at most {self.max_lines} lines')
+
+        try:
+            lines = [(int(product), int(count)) for product, count in zip(products, counts)]
+        except ValueError:
+            raise ValidationError('Product and count must be integers')
+        if any(count < 1 for _, count in lines):
+            raise ValidationError('Count must be positive')
+
+        self.cleaned_data['lines'] = lines
+        return self.cleaned_data
+
+
+class ExportForm(Form):
+    """ '?format=csv&since=2020-01-01&until=2020-01-31&buyer=user1' filters of the export """
+
+    format = ChoiceField(choices=[(name, name) for name in FORMATS], required=False)
+    since = DateField(required=False)
+    until = DateField(required=False)
+    buyer = CharField(max_length=150, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        since, until = cleaned_data.get('since'), cleaned_data.get('until')
+        if since and until and since > until:
+            raise ValidationError('since must not be after until')
+        cleaned_data['format'] = cleaned_data.get('format') or 'csv'
+        return cleaned_data
+
+
+class ProductSearchForm(Form):
+    """ '?q=pot&price=10-50&in_stock=on' words and selected facets of the search page """
+
+    q = CharField(max_length=100, required=False)
+    price = ChoiceField(choices=[(key, label) for key, (label, _, _) in PRICE_RANGES.items()], required=False)
+    in_stock = BooleanField(required=False)
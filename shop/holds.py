@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from shop import catalogue
+from shop import checkout
+from shop import idempotency
+from shop import models
+
+logger = logging.getLogger('shop.holds')
+
+BATCH_SIZE = 5000
+HOLD_TTL = getattr(settings, 'SHOP_HOLD_TTL', 10 * 60)
+
+
+class _OutOfStock(Exception):
+    pass
+
+
+def hold(user, product_pk, count, ttl=None):
+    """ keep count units of product for user for ttl seconds (SHOP_HOLD_TTL).
+    Reserved with one conditional UPDATE, so holds never exceed the stock.
+    Returns the StockHold, raises checkout.SoldOut """
+
+    with transaction.atomic():
+        if not (models.Product.objects
+                .filter(pk=product_pk, count__gte=F('reserved') + count)
+                .update(reserved=F('reserved') + count)):
+            raise checkout.shortage({product_pk: count})
+        stock_hold = models.StockHold.objects.create(
+            user=user, product_id=product_pk, count=count,
+            expires=timezone.now() + timedelta(seconds=ttl or HOLD_TTL))
+        transaction.on_commit(lambda: catalogue.invalidate_product(product_pk))
+    return stock_hold
+
+
+def _claim(holds):
+    """ (pk, product_id, count) of holds, locked by a no-op UPDATE first: the
+    write takes the row locks (and SQLite's write lock) before the read, so
+    every hold is released or bought only once """
+
+    holds.update(count=F('count'))
+    return list(holds.values_list('pk', 'product_id', 'count'))
+
+
+def _per_product(rows):
+    units = defaultdict(int)
+    for _, product_id, count in rows:
+        units[product_id] += count
+    return units
+
+
+def _release(rows):
+    """ delete claimed holds, give their units back with one CASE update """
+
+    if not rows:
+        return
+    units = _per_product(rows)
+    models.StockHold.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    models.Product.objects.filter(pk__in=units).update(
+        reserved=Case(*[When(pk=pk, then=F('reserved') - count) for pk, count in units.items()],
+                      default=F('reserved')))
+    transaction.on_commit(lambda: [catalogue.invalidate_product(pk) for pk in units])
+
+
+def release(holds):
+    """ give the stock of holds (a StockHold queryset) back now """
+
+    with transaction.atomic():
+        rows = _claim(holds)
+        _release(rows)
+    return rows
+
+
+def cancel(user, hold_pks):
+    """ buyer gives holds back before they expire """
+
+    return release(models.StockHold.objects.filter(user_id=user.pk, pk__in=hold_pks))
+
+
+def purchase(user, hold_pks=None, idempotency_key=None):
+    """ buy unexpired holds of user (all of them, or hold_pks) in one transaction.
+
+    Held units leave count and reserved together, then the buyer is charged
+    as by checkout.purchase_many. Returns created Purchase list, [] when no
+    hold is left, raises checkout.InsufficientFunds, checkout.SoldOut when
+    stock was taken away under a hold, or idempotency.AlreadyProcessed.
+    """
+
+    holds = models.StockHold.objects.filter(user_id=user.pk, expires__gt=timezone.now())
+    if hold_pks is not None:
+        holds = holds.filter(pk__in=hold_pks)
+
+    try:
+        with transaction.atomic():
+            idempotency.claim(user.pk, idempotency_key)
+            rows = _claim(holds)
+            if not rows:
+                return []
+            ordered = _per_product(rows)
+            models.StockHold.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+            # count is lowered under holds only by hand, reserved stays within it
+            held = Q()
+            for pk, count in ordered.items():
+                held |= Q(pk=pk, count__gte=count, reserved__gte=count)
+            stock_updated = (models.Product.objects
+                             .filter(held)
+                             .update(count=Case(*[When(pk=pk, then=F('count') - count)
+                                                  for pk, count in ordered.items()],
+                                                default=F('count')),
+                                     reserved=Case(*[When(pk=pk, then=F('reserved') - count)
+                                                     for pk, count in ordered.items()],
+                                                   default=F('reserved'))))
+            if stock_updated != len(ordered):
+                raise _OutOfStock
+            return checkout.charge(user, ordered)
+    except _OutOfStock:
+        raise checkout.shortage(ordered)
+
+
+def expire(batch_size=BATCH_SIZE, now=None):
+    """ release holds past their expiry, batch_size holds per transaction over
+    the expires index. A batch costs one Product update however many holds of
+    a hot product it releases. Returns the number of released holds """
+
+    now = now or timezone.now()
+    stale = models.StockHold.objects.filter(expires__lte=now)
+    released = 0
+    while True:
+        pks = list(stale.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return released
+        # holds bought or cancelled meanwhile are gone from the claim
+        released += len(release(stale.filter(pk__in=pks)))
+
+
+def start_expiry(interval):
+    """ in-process scheduler: expire() every interval seconds in a daemon thread """
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                expire()
+            except Exception:
+                logger.exception('hold expiry failed')
+            finally:
+                connection.close()
+
+    thread = threading.Thread(target=run, name='shop-hold-expiry', daemon=True)
+    thread.start()
+    return thread
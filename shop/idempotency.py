@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from shop import models
+
+BATCH_SIZE = 5000
+KEY_FIELD = 'idempotency_key'
+
+
+class AlreadyProcessed(Exception):
+    pass
+
+
+def request_key(request):
+    """ key of a submission: form field or Idempotency-Key header, None if missing """
+
+    key = request.POST.get(KEY_FIELD) or request.META.get('HTTP_IDEMPOTENCY_KEY')
+    return key[:64] if key else None
+
+
+def claim(user_id, key):
+    """ mark key of user as used, AlreadyProcessed if it was. Call it inside
+    the transaction doing the work: when that rolls back, the key is free again """
+
+    if not key:
+        return
+    try:
+        with transaction.atomic():
+            models.IdempotencyKey.objects.create(user_id=user_id, key=key)
+    except IntegrityError:
+        raise AlreadyProcessed(key)
+
+
+def purge(ttl=None, batch_size=BATCH_SIZE):
+    """ delete keys older than ttl seconds (settings.SHOP_IDEMPOTENCY_TTL) in
+    batches, returns how many were deleted """
+
+    ttl = ttl if ttl is not None else getattr(settings, 'SHOP_IDEMPOTENCY_TTL', 24 * 60 * 60)
+    stale = models.IdempotencyKey.objects.filter(created__lt=timezone.now() - timedelta(seconds=ttl))
+    deleted = 0
+    while True:
+        pks = list(stale.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += models.IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
@@ -0,0 +1,107 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps, features
+
+from shop import catalogue
+from shop import models
+
+logger = logging.getLogger('shop.images')
+
+VARIANTS_DIR = 'shop/product_image/variants/'
+
+# field -> (max size, Pillow format, extension, quality)
+VARIANTS = {
+    'photo_card': ((400, 400), 'JPEG', 'jpg', 82),
+    'photo_thumb': ((96, 96), 'JPEG', 'jpg', 75),
+    'photo_webp': ((400, 400), 'WEBP', 'webp', 75),
+}
+
+_executor = None
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'SHOP_IMAGE_WORKERS', 2),
+                                       thread_name_prefix='shop-images')
+    return _executor
+
+
+def schedule(product_pk):
+    """ build variants after commit, in the worker pool unless SHOP_IMAGE_SYNC """
+
+    if getattr(settings, 'SHOP_IMAGE_SYNC', False):
+        transaction.on_commit(lambda: process(product_pk))
+    else:
+        transaction.on_commit(lambda: executor().submit(_process_in_worker, product_pk))
+
+
+def _process_in_worker(product_pk):
+    try:
+        process(product_pk)
+    except Exception:
+        logger.exception('image variants of product %s failed', product_pk)
+    finally:
+        connection.close()
+
+
+def _render(image, size, image_format, quality):
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+    if image_format == 'JPEG' and variant.mode != 'RGB':
+        variant = variant.convert('RGB')
+    output = BytesIO()
+    variant.save(output, image_format, quality=quality, optimize=True,
+                 **({'progressive': True} if image_format == 'JPEG' else {}))
+    return output.getvalue()
+
+
+def process(product_pk):
+    """ write resized variants of product photo under content-hashed names """
+
+    product = models.Product.objects.only('pk', 'photo').get(pk=product_pk)
+    source = product.photo.name
+    with product.photo.open('rb') as photo:
+        content = photo.read()
+
+    variants = dict.fromkeys(VARIANTS, '')
+    try:
+        image = ImageOps.exif_transpose(Image.open(BytesIO(content)))
+    except OSError:
+        image = None  # svg and other non raster files are served as uploaded
+
+    if image is not None:
+        digest = hashlib.sha1(content).hexdigest()[:12]
+        stem = os.path.splitext(os.path.basename(source))[0]
+        for field, (size, image_format, extension, quality) in VARIANTS.items():
+            if image_format == 'WEBP' and not features.check('webp'):
+                continue
+            name = f'{VARIANTS_DIR}{stem}.{digest}.{field[6:]}.{extension}'
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(_render(image, size, image_format, quality)))
+            variants[field] = name
+
+    # photo may have been replaced while we were busy, then its own job wins
+    if models.Product.objects.filter(pk=product_pk, photo=source).update(**variants):
+        catalogue.invalidate_product(product_pk)
+    return variants
+
+
+@receiver(post_save, sender=models.Product)
+def product_saved(sender, instance, update_fields=None, **kwargs):
+    """ new or replaced photos only, price and stock edits keep their variants """
+
+    if not instance.photo or (update_fields is not None and 'photo' not in update_fields):
+        return
+    if instance.photo.name != getattr(instance, 'loaded_values', {}).get('photo'):
+        schedule(instance.pk)
@@ -0,0 +1,92 @@
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from shop import account
+from shop import catalogue
+from shop import models
+
+# model -> (balance field, its owner id field, LedgerEvent owner field, LedgerEvent delta field)
+BALANCES = {
+    models.Product: ('count', 'pk', 'product_id', 'stock_delta'),
+    models.Profile: ('cash', 'user_id', 'user_id', 'cash_delta'),
+}
+
+
+def record(events):
+    """ append LedgerEvent objects with one INSERT, in the caller's transaction,
+    so the log never disagrees with the balances it explains """
+
+    if events:
+        models.LedgerEvent.objects.bulk_create(events)
+
+
+def _ledger_sum(model):
+    field, owner, event_owner, delta = BALANCES[model]
+    total = (models.LedgerEvent.objects
+             .filter(**{event_owner: OuterRef(owner)})
+             .order_by()
+             .values(event_owner)
+             .annotate(total=Sum(delta))
+             .values('total'))
+    return Coalesce(Subquery(total), 0, output_field=model._meta.get_field(field))
+
+
+def mismatches(model):
+    """ rows of model whose balance differs from the sum of their events,
+    one statement, so no locks and a consistent snapshot """
+
+    field = BALANCES[model][0]
+    return (model.objects
+            .annotate(ledger=_ledger_sum(model))
+            .exclude(**{field: F('ledger')})
+            .order_by('pk'))
+
+
+def rebuild(model):
+    """ set balances from the events where they differ, returns changed rows.
+    Cached account summaries and product cards of those rows are dropped """
+
+    field, owner = BALANCES[model][:2]
+    owners = list(mismatches(model).values_list(owner, flat=True))
+    changed = (mismatches(model)
+               .filter(**{f'{owner}__in': owners})
+               .update(**{field: _ledger_sum(model)}))
+    if model is models.Profile:
+        account.invalidate(*owners)
+    else:
+        transaction.on_commit(lambda: [catalogue.invalidate_product(pk) for pk in owners])
+    return changed
+
+
+@receiver(pre_save, sender=models.Product)
+@receiver(pre_save, sender=models.Profile)
+def remember_balance(sender, instance, update_fields=None, **kwargs):
+    """ the balance before the save, as loaded (see models.LoadedValues).
+    Only instances that were never loaded, or loaded with the balance deferred,
+    read it from the database """
+
+    field = BALANCES[sender][0]
+    instance._ledger_balance = None
+    if instance.pk and (update_fields is None or field in update_fields):
+        instance._ledger_balance = getattr(instance, 'loaded_values', {}).get(field)
+        if instance._ledger_balance is None:
+            instance._ledger_balance = (sender.objects.filter(pk=instance.pk)
+                                        .values_list(field, flat=True).first())
+
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_save, sender=models.Profile)
+def record_adjustment(sender, instance, created, update_fields=None, **kwargs):
+    """ form, admin and other save() changes of stock or cash """
+
+    field, owner, event_owner, delta_field = BALANCES[sender]
+    if not created and getattr(instance, '_ledger_balance', None) is None:
+        return
+    balance = sender._meta.get_field(field).to_python(getattr(instance, field))  # defaults may be floats
+    delta = balance - (0 if created else instance._ledger_balance)
+    if delta:
+        record([models.LedgerEvent(kind=models.LedgerEvent.ADJUST,
+                                   **{event_owner: getattr(instance, owner), delta_field: delta})])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop import ledger
+from shop import models
+
+
+class Command(BaseCommand):
+    help = 'compare product stock and profile cash with the sums of the ledger events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='set balances from the ledger')
+
+    def handle(self, *args, rebuild, **options):
+        found = 0
+        for model in ledger.BALANCES:
+            field = ledger.BALANCES[model][0]
+            for row in ledger.mismatches(model).values('pk', field, 'ledger'):
+                found += 1
+                self.stdout.write(f"{model._meta.label} {row['pk']}: {field} {row[field]}, "
+                                  f"ledger {row['ledger']}")
+
+        if rebuild:
+            with transaction.atomic():
+                for model in ledger.BALANCES:
+                    self.stdout.write(f'{model._meta.label}: {ledger.rebuild(model)} rebuilt')
+        elif found:
+            raise CommandError(f'{found} balances differ from the ledger')
+        else:
+            self.stdout.write(self.style.SUCCESS('balances match the ledger'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop import models
+from shop import stats
+
+
+class Command(BaseCommand):
+    help = 'fill the daily sales rollups from purchase history, in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=stats.BATCH_SIZE)
+        parser.add_argument('--reset', action='store_true', help='delete existing rollups first')
+
+    def handle(self, *args, chunk_size, reset, **options):
+        rollups = (models.DailyProductStats, models.DailyBuyerStats)
+        if reset:
+            with transaction.atomic():
+                for model in rollups:
+                    model.objects.all().delete()
+        elif any(model.objects.exists() for model in rollups):
+            raise CommandError('rollups are not empty, backfill would count sales twice (use --reset)')
+
+        done = 0
+        for done in stats.backfill(chunk_size):
+            self.stdout.write(f'{done} purchases')
+        self.stdout.write(self.style.SUCCESS(f'done, {done} purchases'))
@@ -0,0 +1,80 @@
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from shop import models
+from shop import search
+
+BATCH_SIZE = 2000
+
+# parents first, so foreign keys always point at copied rows
+MODELS = (User, models.Profile, models.Product, models.Purchase, models.Return, models.LedgerEvent,
+          models.StockHold, models.DailyProductStats, models.DailyBuyerStats, models.IdempotencyKey)
+
+
+@contextmanager
+def keep_timestamps():
+    """ let bulk_create write copied time/post_time/created instead of now() """
+
+    fields = [models.Purchase._meta.get_field('time'), models.Return._meta.get_field('post_time'),
+              models.StockHold._meta.get_field('created'), models.IdempotencyKey._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'copy shop data from the sqlite database alias into an empty default database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='sqlite')
+        parser.add_argument('--target', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, source, target, batch_size, **options):
+        if source not in connections.databases:
+            raise CommandError(f'no "{source}" database, set DB_ENGINE=postgresql to get it')
+        if source == target:
+            raise CommandError('source and target are the same database')
+        for model in MODELS:
+            if model.objects.using(target).exists():
+                raise CommandError(f'{model._meta.label} rows already in "{target}", '
+                                   f'run migrate on an empty database first')
+
+        with keep_timestamps(), transaction.atomic(using=target):
+            for model in MODELS:
+                copied = self.copy(model, source, target, batch_size)
+                self.stdout.write(f'{model._meta.label}: {copied}')
+
+            # explicit primary keys leave PostgreSQL sequences behind
+            connection = connections[target]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), MODELS):
+                    cursor.execute(sql)
+            # bulk_create sent no post_save, index the copied products
+            search.rebuild(target)
+
+        self.stdout.write(self.style.SUCCESS('done'))
+
+    @staticmethod
+    def copy(model, source, target, batch_size):
+        rows = model.objects.using(source).order_by('pk').iterator(chunk_size=batch_size)
+        copied = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                model.objects.using(target).bulk_create(batch)
+                copied += len(batch)
+                batch = []
+        if batch:
+            model.objects.using(target).bulk_create(batch)
+            copied += len(batch)
+        return copied
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import holds
+
+
+class Command(BaseCommand):
+    help = 'give the stock of expired cart holds back, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=holds.BATCH_SIZE)
+        parser.add_argument('--every', type=int, help='keep running, release every N seconds')
+
+    def handle(self, *args, batch_size, every, **options):
+        while True:
+            released = holds.expire(batch_size)
+            if options['verbosity']:
+                self.stdout.write(f'{released} holds released')
+            if not every:
+                return
+            time.sleep(every)
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import returns
+
+
+class Command(BaseCommand):
+    help = 'mark returnable purchases past their return deadline as expired, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=returns.BATCH_SIZE)
+        parser.add_argument('--every', type=int, help='keep running, expire every N seconds')
+
+    def handle(self, *args, batch_size, every, **options):
+        while True:
+            expired = returns.expire(batch_size)
+            if options['verbosity']:
+                self.stdout.write(f'{expired} purchases expired')
+            if not every:
+                return
+            time.sleep(every)
@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import export
+from shop import forms
+from shop import routers
+
+
+class Command(BaseCommand):
+    help = 'stream purchases or returns as csv or json lines, in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(export.EXPORTS))
+        parser.add_argument('--format', default='csv', choices=list(export.FORMATS))
+        parser.add_argument('--since', help='first day, YYYY-MM-DD')
+        parser.add_argument('--until', help='last day, YYYY-MM-DD')
+        parser.add_argument('--buyer', help='username')
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE)
+        parser.add_argument('--output', default='-', help='file name, - for stdout')
+        parser.add_argument('--database', help='database alias, a replica when there is one')
+
+    def handle(self, *args, kind, chunk_size, output, database, **options):
+        form = forms.ExportForm({key: options[key] for key in ('format', 'since', 'until', 'buyer')
+                                 if options[key]})
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        filters = form.cleaned_data.copy()
+        export_format = filters.pop('format')
+
+        stream = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+        try:
+            for line in export.lines(kind, export_format, chunk_size=chunk_size,
+                                     using=database or routers.replica(), **filters):
+                stream.write(line)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
@@ -0,0 +1,62 @@
+import csv
+import sys
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import models
+from shop import provisioning
+
+
+class Command(BaseCommand):
+    help = ('create buyer accounts from a CSV file with username, email and optional cash columns '
+            '(header row required), in bulk. Without --password users get unusable passwords '
+            'and log in after a password reset')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file, - for stdin')
+        parser.add_argument('--password', help='initial password of every created user')
+        parser.add_argument('--cash', type=Decimal, help='cash of rows without one, Profile default otherwise')
+        parser.add_argument('--batch-size', type=int, default=provisioning.BATCH_SIZE)
+
+    def handle(self, *args, path, password, cash, batch_size, **options):
+        if path == '-':
+            accounts = self.read(sys.stdin, cash)
+        else:
+            with open(path, newline='') as source:
+                accounts = self.read(source, cash)
+
+        created, skipped = provisioning.provision(accounts, password, batch_size)
+        if skipped:
+            self.stdout.write(f'{len(skipped)} existing users skipped: {", ".join(skipped[:20])}'
+                              f'{" ..." if len(skipped) > 20 else ""}')
+        self.stdout.write(self.style.SUCCESS(f'{created} users created'))
+
+    @staticmethod
+    def read(source, default_cash):
+        """ validated (username, email, cash) tuples, every error raised before anything is written """
+
+        reader = csv.DictReader(source)
+        if not reader.fieldnames or 'username' not in reader.fieldnames:
+            raise CommandError('no "username" column in the header row')
+        username_field = User._meta.get_field('username')
+        email_field = User._meta.get_field('email')
+        cash_field = models.Profile._meta.get_field('cash')
+        accounts, seen = [], set()
+        for row in reader:
+            line = reader.line_num
+            try:
+                username = username_field.clean(User.normalize_username((row['username'] or '').strip()), None)
+                email = email_field.clean(User.objects.normalize_email((row.get('email') or '').strip()), None)
+                cash = (row.get('cash') or '').strip() or default_cash
+                if cash is not None:
+                    cash = cash_field.clean(cash, None)
+            except ValidationError as error:
+                raise CommandError(f'line {line}: {"; ".join(error.messages)}')
+            if username in seen:
+                raise CommandError(f'line {line}: username "{username}" repeats')
+            seen.add(username)
+            accounts.append((username, email, cash))
+        return accounts
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from shop import idempotency
+
+
+class Command(BaseCommand):
+    help = 'delete idempotency keys older than SHOP_IDEMPOTENCY_TTL, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, help='seconds, default settings.SHOP_IDEMPOTENCY_TTL')
+        parser.add_argument('--batch-size', type=int, default=idempotency.BATCH_SIZE)
+
+    def handle(self, *args, ttl, batch_size, **options):
+        deleted = idempotency.purge(ttl, batch_size)
+        self.stdout.write(f'{deleted} keys deleted')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from shop import search
+
+
+class Command(BaseCommand):
+    help = 'index every product for search again, after bulk_create/update() or a restore'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, database, **options):
+        with transaction.atomic(using=database):
+            search.rebuild(database)
+        self.stdout.write(self.style.SUCCESS('done'))
@@ -0,0 +1,271 @@
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from queue import Empty, Queue
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from shop import account
+from shop import models
+from shop import provisioning
+from shop import search
+
+BATCH_SIZE = 5000
+BENCH_CASH = Decimal('1000000000.00')
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class QueryCounter:
+    """ execute_wrapper counting queries of the current thread connection """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ('Seed a throw-away test database and benchmark the shop URLs with '
+            'concurrent clients. Reports latency percentiles, rps and queries per request.')
+    reported_options = ('users', 'products', 'purchases', 'returns', 'clients', 'requests', 'seed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--purchases', type=int, default=100000)
+        parser.add_argument('--returns', type=int, default=1000)
+        parser.add_argument('--clients', type=int, default=8, help='concurrent clients per endpoint')
+        parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default='bench_results.json')
+        parser.add_argument('--keepdb', action='store_true', help='reuse a seeded test database')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+
+        setup_test_environment()
+        settings.DEBUG = False
+        # concurrent clients on a throw-away file, readers must not wait for writers
+        settings.SHOP_SQLITE_WAL = True
+        if connection.vendor == 'sqlite':
+            # shared-cache memory databases fail instead of waiting on locks
+            connection.settings_dict['TEST']['NAME'] = os.path.join(settings.BASE_DIR, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, keepdb=options['keepdb'],
+                                                      serialize=False)
+        try:
+            if not models.Product.objects.exists():
+                self.seed()
+            results = self.run_all()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        report = {
+            'commit': self.git_commit(),
+            'time': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'options': {key: options[key] for key in self.reported_options},
+            'endpoints': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:16} p50 {result['p50_ms'] or 0:8.2f}ms  p95 {result['p95_ms'] or 0:8.2f}ms  "
+                f"p99 {result['p99_ms'] or 0:8.2f}ms  {result['rps'] or 0:8.1f} rps  "
+                f"{result['queries_per_request'] or 0:6.1f} q/req  errors {result['errors']}")
+        self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}"))
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                           stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def batches(self, objects):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def seed(self):
+        options = self.options
+        rand = self.random
+        self.stdout.write('Seeding...')
+
+        User.objects.create_superuser('bench-admin', 'admin@bench.local', 'bench')
+        provisioning.provision(((f'bench{n}', '', BENCH_CASH) for n in range(options['users'])),
+                               'bench', BATCH_SIZE)
+        user_ids = list(User.objects.filter(is_superuser=False).values_list('pk', flat=True))
+
+        for batch in self.batches(
+                models.Product(name=f'product {n}', description='bench product',
+                               price=Decimal(rand.randint(100, 100000)) / 100,
+                               photo='shop/product_image/icons8-cooking-pot.svg',
+                               count=10 ** 6)
+                for n in range(options['products'])):
+            models.Product.objects.bulk_create(batch)
+        search.rebuild()
+        product_ids = list(models.Product.objects.values_list('pk', flat=True))
+
+        now = timezone.now()
+        for batch in self.batches(
+                models.Purchase(buyer_id=rand.choice(user_ids), product_id=rand.choice(product_ids),
+                                count=rand.randint(1, 5), return_deadline=now)
+                for _ in range(options['purchases'])):
+            models.Purchase.objects.bulk_create(batch)
+        # auto_now_add stamps every row with now, spread history over a year
+        first_id = models.Purchase.objects.order_by('pk').values_list('pk', flat=True).first() or 0
+        for offset in range(0, options['purchases'], BATCH_SIZE):
+            time = now - timedelta(minutes=rand.randint(10, 60 * 24 * 365))
+            models.Purchase.objects.filter(
+                pk__gte=first_id + offset, pk__lt=first_id + offset + BATCH_SIZE,
+            ).update(time=time, return_deadline=time + timedelta(minutes=3),
+                     return_state=models.Purchase.EXPIRED)
+
+        returned = (models.Purchase.objects.order_by('?')
+                    .values_list('pk', flat=True)[:options['returns']])
+        for batch in self.batches(models.Return(purchase_id=pk) for pk in returned):
+            models.Return.objects.bulk_create(batch)
+        models.Purchase.objects.filter(purchase__isnull=False).update(return_state=models.Purchase.REQUESTED)
+        account.rebuild()
+        self.stdout.write('Seeded.')
+
+    def scenarios(self, buyers):
+        """ name -> (role, request factory(client, user)) """
+
+        product_ids = list(models.Product.objects.values_list('pk', flat=True))
+        pending = Queue()
+        for pk in models.Return.objects.values_list('pk', flat=True):
+            pending.put(pk)
+
+        # fresh purchases inside the return window, made before the clock starts
+        returnable = {user.pk: Queue() for user in buyers}
+        per_client = max(1, self.options['requests'] // self.options['clients'])
+        models.Purchase.objects.bulk_create(
+            models.Purchase(buyer=user, product_id=self.random.choice(product_ids), count=1,
+                            return_deadline=timezone.now() + timedelta(hours=1))
+            for user in buyers for _ in range(per_client))
+        for pk, buyer_id in (models.Purchase.objects.filter(buyer__in=buyers, purchase__isnull=True)
+                             .order_by('-pk').values_list('pk', 'buyer_id')[:len(buyers) * per_client]):
+            returnable[buyer_id].put(pk)
+
+        def return_create(client, user):
+            try:
+                pk = returnable[user.pk].get_nowait()
+            except Empty:
+                return None
+            return client.post(reverse('shop:return_create'), {'purchase': pk})
+
+        def purchase_delete(client, user):
+            try:
+                pk = pending.get_nowait()
+            except Empty:
+                return None
+            return client.post(reverse('shop:purchase_delete', args=[pk]))
+
+        return {
+            'index': ('anonymous', lambda client, user: client.get(reverse('shop:index'))),
+            'search': ('anonymous', lambda client, user: client.get(
+                reverse('shop:search'), {'q': f'product {self.random.randint(1, 99)}', 'in_stock': 'on'})),
+            'purchase_create': ('buyer', lambda client, user: client.post(
+                reverse('shop:purchase_create', args=[self.random.choice(product_ids)]), {'count': 1})),
+            'purchase_list': ('buyer', lambda client, user: client.get(reverse('shop:purchase_list'))),
+            'return_create': ('buyer', return_create),
+            'return_list': ('admin', lambda client, user: client.get(reverse('shop:return_list'))),
+            'purchase_delete': ('admin', purchase_delete),
+        }
+
+    def run_all(self):
+        buyers = list(User.objects.filter(is_superuser=False).order_by('?')[:self.options['clients']])
+        admin = User.objects.filter(is_superuser=True).first()
+        return {name: self.run(role, make_request, buyers, admin)
+                for name, (role, make_request) in self.scenarios(buyers).items()}
+
+    def run(self, role, make_request, buyers, admin):
+        clients = self.options['clients']
+        per_client = max(1, self.options['requests'] // clients)
+        latencies, queries, errors = [], [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(clients)
+
+        def worker(n):
+            client, user = Client(), {'buyer': buyers[n % len(buyers)], 'admin': admin}.get(role)
+            if user is not None:
+                with lock:
+                    client.force_login(user)
+
+            barrier.wait()
+            try:
+                for _ in range(per_client):
+                    counter = QueryCounter()
+                    start = time.perf_counter()
+                    try:
+                        with connection.execute_wrapper(counter):
+                            response = make_request(client, user)
+                    except Exception as error:
+                        with lock:
+                            errors.append(repr(error))
+                        continue
+                    elapsed = time.perf_counter() - start
+                    if response is None:
+                        continue
+                    with lock:
+                        latencies.append(elapsed)
+                        queries.append(counter.count)
+                        if response.status_code >= 400:
+                            errors.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        def ms(value):
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'error_kinds': dict(Counter(str(error)[:120] for error in errors)),
+            'p50_ms': ms(percentile(latencies, 50)),
+            'p95_ms': ms(percentile(latencies, 95)),
+            'p99_ms': ms(percentile(latencies, 99)),
+            'rps': round(len(latencies) / wall, 2) if wall else None,
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        }
@@ -0,0 +1,136 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from shop import catalogue
+from shop import models
+from shop.management.commands import shop_bench
+
+# mode -> loaders, None for APP_DIRS without caching (Django 2.2 with DEBUG)
+MODES = {
+    'debug': None,
+    'production': [('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ])],
+}
+
+
+class Command(BaseCommand):
+    help = ('Render the list pages with --rows rows and with none, from in-memory objects '
+            '(no database), with debug and production (cached) template loaders. '
+            'Reports ms per page and the per-row cost.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=50, help='renders per page and mode')
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+        parser.add_argument('--output', default='render_bench_results.json')
+
+    def handle(self, *args, **options):
+        self.options = options
+        rows = options['rows']
+        results = {}
+        for mode in options['modes']:
+            engine = self.engine(mode)
+            for name, render in self.pages(engine).items():
+                full = self.time(render, rows)
+                empty = self.time(render, 0)
+                results[f'{name}@{mode}'] = {
+                    'p50_ms': full,
+                    'empty_p50_ms': empty,
+                    'per_row_us': (full - empty) * 1000 / rows if rows else None,
+                }
+
+        report = {
+            'commit': shop_bench.Command.git_commit(),
+            'time': timezone.now().isoformat(),
+            'options': {key: options[key] for key in ('rows', 'repeat', 'modes')},
+            'pages': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:24} {result['p50_ms']:8.2f}ms/page  empty {result['empty_p50_ms']:8.2f}ms  "
+                f"{result['per_row_us'] or 0:8.1f}us/row")
+        self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}"))
+
+    def time(self, render, rows):
+        render(rows)  # warm up, the production loaders parse here
+        timings = []
+        for _ in range(self.options['repeat']):
+            start = time.perf_counter()
+            render(rows)
+            timings.append((time.perf_counter() - start) * 1000)
+        return shop_bench.percentile(timings, 50)
+
+    @staticmethod
+    def engine(mode):
+        options = dict(settings.TEMPLATES[0]['OPTIONS'], debug=mode == 'debug')
+        options.pop('loaders', None)
+        if MODES[mode]:
+            options['loaders'] = MODES[mode]
+        return DjangoTemplates({
+            'NAME': f'render-bench-{mode}',
+            'DIRS': [],
+            'APP_DIRS': not MODES[mode],
+            'OPTIONS': options,
+        })
+
+    def pages(self, engine):
+        """ name -> render(rows) """
+
+        buyer = User(pk=1, username='bench-buyer')
+        admin = User(pk=2, username='bench-admin', is_superuser=True)
+        now = timezone.now()
+        products = [models.Product(pk=pk, name=f'product {pk}', description='bench product',
+                                   price=Decimal('9.99'), photo='shop/product_image/bench.png', count=10)
+                    for pk in range(1, self.options['rows'] + 1)]
+        purchases = []
+        for pk, product in enumerate(products, 1):
+            purchase = models.Purchase(pk=pk, buyer=buyer, product=product, count=1, time=now,
+                                       return_deadline=now + timedelta(minutes=3))
+            purchase.total = product.price
+            purchases.append(purchase)
+        returns = []
+        for purchase in purchases:
+            return_ = models.Return(purchase=purchase, post_time=now)
+            return_.total = purchase.total
+            returns.append(return_)
+        holds = []
+        for pk, product in enumerate(products, 1):
+            stock_hold = models.StockHold(pk=pk, user=buyer, product=product, count=1, expires=now)
+            stock_hold.total = product.price
+            holds.append(stock_hold)
+
+        factory = RequestFactory()
+
+        def page(template_name, path, user, name, objects, **context):
+            def render(rows):
+                request = factory.get(path)
+                request.user = user
+                engine.get_template(template_name).render(
+                    dict(context, account=None, is_paginated=False, **{name: objects[:rows]}), request)
+            return render
+
+        return {
+            'purchase_list': page('shop/purchase/list.html', reverse('shop:purchase_list'), buyer,
+                                  'purchases', purchases, now=now,
+                                  return_states=models.Purchase.RETURN_STATES),
+            'return_list': page('shop/return/list.html', reverse('shop:return_list'), admin,
+                                'returns', returns),
+            'hold_list': page('shop/hold/list.html', reverse('shop:hold_list'), buyer, 'holds', holds),
+            # index pages render cards only on catalogue cache misses
+            'cards': lambda rows: catalogue.render_cards(products[:rows], 'buyer', engine),
+        }
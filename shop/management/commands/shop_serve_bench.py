@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.urls import reverse
+
+from shop import asgi
+from shop.management.commands import shop_bench
+
+
+class Command(shop_bench.Command):
+    help = ('Compare WSGI and ASGI serving of the read-heavy shop pages at equal worker counts. '
+            'Clients take --client-delay ms to send a request and again to read the response: '
+            'a WSGI worker waits for them, the ASGI event loop does not.')
+    reported_options = shop_bench.Command.reported_options + ('workers', 'client_delay')
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.set_defaults(clients=64, requests=512, output='serve_bench_results.json')
+        parser.add_argument('--workers', type=int, default=8, help='WSGI worker threads = ASGI view threads')
+        parser.add_argument('--client-delay', type=float, default=50, help='ms to upload and to download')
+
+    def run_all(self):
+        scenarios = {
+            'index': (None, reverse('shop:index')),
+            'purchase_list': (User.objects.filter(is_superuser=False).first(), reverse('shop:purchase_list')),
+            'return_list': (User.objects.filter(is_superuser=True).first(), reverse('shop:return_list')),
+        }
+        self.wsgi_application = get_wsgi_application()
+        self.per_client = max(1, self.options['requests'] // self.options['clients'])
+        results = {}
+        for name, (user, path) in scenarios.items():
+            scope = self.scope(path, self.cookie(user))
+            results[f'{name}@wsgi'] = self.run_wsgi(scope)
+            results[f'{name}@asgi'] = self.run_asgi(scope)
+        return results
+
+    @staticmethod
+    def cookie(user):
+        if user is None:
+            return b''
+        client = Client()
+        client.force_login(user)
+        return '; '.join(f'{key}={morsel.value}' for key, morsel in client.cookies.items()).encode()
+
+    @staticmethod
+    def scope(path, cookie):
+        return {
+            'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'root_path': '', 'query_string': b'',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie)],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+        }
+
+    def report(self, latencies, statuses, wall):
+        def ms(value):
+            return round(value * 1000, 3) if value is not None else None
+
+        errors = [status for status in statuses if status >= 400]
+        return {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'error_kinds': dict(Counter(str(status) for status in errors)),
+            'p50_ms': ms(shop_bench.percentile(latencies, 50)),
+            'p95_ms': ms(shop_bench.percentile(latencies, 95)),
+            'p99_ms': ms(shop_bench.percentile(latencies, 99)),
+            'rps': round(len(latencies) / wall, 2) if wall else None,
+            'queries_per_request': None,
+        }
+
+    def run_wsgi(self, scope):
+        """ worker thread busy from first request byte to last response byte """
+
+        delay = self.options['client_delay'] / 1000
+        latencies, statuses = [], []
+        lock = threading.Lock()
+
+        def serve():
+            time.sleep(delay)  # reading a slow request
+            started = []
+            chunks = self.wsgi_application(asgi.environ(scope, BytesIO()),
+                                           lambda status, headers, exc_info=None: started.append(status))
+            try:
+                b''.join(chunks)
+            finally:
+                chunks.close()
+            time.sleep(delay)  # writing to a slow client
+            return int(started[0].split(' ', 1)[0])
+
+        def client(workers):
+            for _ in range(self.per_client):
+                sent = time.perf_counter()
+                status = workers.submit(serve).result()
+                with lock:
+                    latencies.append(time.perf_counter() - sent)
+                    statuses.append(status)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.options['workers']) as workers:
+            clients = [threading.Thread(target=client, args=(workers,)) for _ in range(self.options['clients'])]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+        return self.report(latencies, statuses, time.perf_counter() - started)
+
+    def run_asgi(self, scope):
+        """ slow clients wait on the event loop, views run in a pool of the same size """
+
+        delay = self.options['client_delay'] / 1000
+        handler = asgi.ASGIHandler(self.wsgi_application, workers=self.options['workers'])
+        latencies, statuses = [], []
+
+        async def receive():
+            await asyncio.sleep(delay)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            elif not message.get('more_body'):
+                await asyncio.sleep(delay)
+
+        async def client():
+            for _ in range(self.per_client):
+                sent = time.perf_counter()
+                await handler(scope, receive, send)
+                latencies.append(time.perf_counter() - sent)
+
+        async def main():
+            await asyncio.gather(*(client() for _ in range(self.options['clients'])))
+
+        started = time.perf_counter()
+        try:
+            asyncio.run(main())
+        finally:
+            handler.executor.shutdown(wait=True)
+        return self.report(latencies, statuses, time.perf_counter() - started)
@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from shop import models
+from shop.management.commands import shop_bench
+
+# mode -> (SESSION_ENGINE, MESSAGE_STORAGE), 'before' is the Django default
+MODES = {
+    'before': ('django.contrib.sessions.backends.db',
+               'django.contrib.messages.storage.fallback.FallbackStorage'),
+    'cached_db': ('django.contrib.sessions.backends.cached_db',
+                  'django.contrib.messages.storage.cookie.CookieStorage'),
+    'cache': ('django.contrib.sessions.backends.cache',
+              'django.contrib.messages.storage.cookie.CookieStorage'),
+    'signed_cookies': ('django.contrib.sessions.backends.signed_cookies',
+                       'django.contrib.messages.storage.cookie.CookieStorage'),
+}
+
+
+class Command(shop_bench.Command):
+    help = ('Compare queries per request of logged in buyer pages with database, cache and '
+            'signed cookie sessions. Messages use the cookie storage in every mode but "before".')
+    reported_options = shop_bench.Command.reported_options + ('modes',)
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.set_defaults(purchases=10000, output='session_bench_results.json')
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+
+    def scenarios(self, buyers):
+        product_ids = list(models.Product.objects.values_list('pk', flat=True))
+
+        return {
+            'index': ('buyer', lambda client, user: client.get(reverse('shop:index'))),
+            'purchase_list': ('buyer', lambda client, user: client.get(reverse('shop:purchase_list'))),
+            # the redirect carries the message, following it reads it back
+            'purchase_create': ('buyer', lambda client, user: client.post(
+                reverse('shop:purchase_create', args=[self.random.choice(product_ids)]),
+                {'count': 1}, follow=True)),
+        }
+
+    def run_all(self):
+        buyers = list(User.objects.filter(is_superuser=False).order_by('?')[:self.options['clients']])
+        results = {}
+        for mode in self.options['modes']:
+            session_engine, message_storage = MODES[mode]
+            with override_settings(SESSION_ENGINE=session_engine, MESSAGE_STORAGE=message_storage):
+                for name, (role, make_request) in self.scenarios(buyers).items():
+                    results[f'{name}@{mode}'] = self.run(role, make_request, buyers, None)
+        return results
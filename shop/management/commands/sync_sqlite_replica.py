@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from shop import routers
+
+
+class Command(BaseCommand):
+    help = ('copy the SQLite primary into the replica files (SQLITE_REPLICA_PATH), the local '
+            'stand-in for replication. --every N keeps copying, N seconds is the replica lag')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replica', action='append', help='replica alias, all by default')
+        parser.add_argument('--every', type=float, help='keep running, copy every N seconds')
+
+    def handle(self, *args, replica, every, **options):
+        source = connections[DEFAULT_DB_ALIAS]
+        if source.vendor != 'sqlite':
+            raise CommandError('replicas of a PostgreSQL primary are kept by the server')
+        aliases = replica or routers.replicas()
+        if not aliases:
+            raise CommandError('no replica, set SQLITE_REPLICA_PATH')
+
+        while True:
+            for alias in aliases:
+                self.sync(source, connections[alias])
+                if options['verbosity']:
+                    self.stdout.write(f'{alias} synced')
+            if not every:
+                return
+            time.sleep(every)
+
+    @staticmethod
+    def sync(source, target):
+        """ online backup: pages of the primary are copied while it stays writable """
+
+        source.ensure_connection()
+        target.ensure_connection()
+        source.connection.backup(target.connection)
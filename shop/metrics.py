@@ -0,0 +1,103 @@
+import bisect
+import threading
+from collections import defaultdict
+
+# upper bounds of histogram buckets
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """ cumulative histogram in Prometheus sense """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """ in-process per view metrics. One registry per worker process """
+
+    metrics = {
+        'view_seconds': ('View wall time including template rendering', SECONDS_BUCKETS),
+        'db_queries': ('Database queries per request', QUERIES_BUCKETS),
+        'db_seconds': ('Database time per request', SECONDS_BUCKETS),
+        'render_seconds': ('Template render time per request', SECONDS_BUCKETS),
+        'response_bytes': ('Response body size', BYTES_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = defaultdict(dict)
+            self.over_budget = defaultdict(int)
+
+    def observe(self, view, **values):
+        with self.lock:
+            histograms = self.histograms[view]
+            for name, value in values.items():
+                if value is None:
+                    continue
+                if name not in histograms:
+                    histograms[name] = Histogram(self.metrics[name][1])
+                histograms[name].observe(value)
+
+    def flag_over_budget(self, view):
+        with self.lock:
+            self.over_budget[view] += 1
+
+    def snapshot(self):
+        """ {view: {metric: {'count', 'sum', 'buckets'}}, 'over_budget': {...}} """
+
+        with self.lock:
+            views = {
+                view: {name: {'count': histogram.count,
+                              'sum': histogram.sum,
+                              'buckets': list(histogram.cumulative())}
+                       for name, histogram in histograms.items()}
+                for view, histograms in self.histograms.items()
+            }
+            return {'views': views, 'over_budget': dict(self.over_budget)}
+
+    def prometheus(self):
+        """ text exposition format """
+
+        snapshot = self.snapshot()
+        lines = []
+        for name, (description, _) in self.metrics.items():
+            metric = f'shop_{name}'
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} histogram']
+            for view, histograms in sorted(snapshot['views'].items()):
+                if name not in histograms:
+                    continue
+                data = histograms[name]
+                for bound, count in data['buckets']:
+                    lines.append(f'{metric}_bucket{{view="{view}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_sum{{view="{view}"}} {data["sum"]}')
+                lines.append(f'{metric}_count{{view="{view}"}} {data["count"]}')
+
+        metric = 'shop_query_budget_exceeded_total'
+        lines += [f'# HELP {metric} Requests over SHOP_QUERY_BUDGET', f'# TYPE {metric} counter']
+        for view, count in sorted(snapshot['over_budget'].items()):
+            lines.append(f'{metric}{{view="{view}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,74 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from shop.metrics import registry
+
+logger = logging.getLogger('shop.metrics')
+
+
+class QueryTracker:
+    """ execute_wrapper counting queries and their time """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """ wall time, DB queries and time, render time and response size of shop views.
+    Requests over settings.SHOP_QUERY_BUDGET queries are logged and counted """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tracker = QueryTracker()
+        request.render_seconds = None
+        start = time.perf_counter()
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(tracker))
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        if match is None or 'shop' not in match.app_names:
+            return response
+
+        view = match.view_name
+        registry.observe(
+            view,
+            view_seconds=time.perf_counter() - start,
+            db_queries=tracker.count,
+            db_seconds=tracker.seconds,
+            render_seconds=request.render_seconds,
+            response_bytes=None if response.streaming else len(response.content),
+        )
+
+        query_budget = getattr(settings, 'SHOP_QUERY_BUDGET', None)
+        if query_budget is not None and tracker.count > query_budget:
+            registry.flag_over_budget(view)
+            logger.warning('%s %s ran %d queries, budget is %d',
+                           request.method, request.path, tracker.count, query_budget)
+        return response
+
+    def process_template_response(self, request, response):
+        start = time.perf_counter()
+
+        def rendered(response):
+            request.render_seconds = time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
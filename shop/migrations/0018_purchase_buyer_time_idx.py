@@ -0,0 +1,17 @@
+# Generated by Django 2.2 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_purchase_return_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['buyer', '-time'], name='purchase_buyer_time_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.2 on 2026-10-18 10:53
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+
+
+def fill_summary(apps, schema_editor):
+    Profile = apps.get_model('shop', 'Profile')
+    Purchase = apps.get_model('shop', 'Purchase')
+    Return = apps.get_model('shop', 'Return')
+    db_alias = schema_editor.connection.alias
+
+    spent = (Purchase.objects.using(db_alias).values('buyer_id')
+             .annotate(purchases=Count('id'),
+                       spent=Sum(ExpressionWrapper(F('count') * F('product__price'),
+                                                   output_field=DecimalField()))))
+    pending = dict(Return.objects.using(db_alias).values('purchase__buyer_id')
+                   .annotate(pending=Count('pk')).values_list('purchase__buyer_id', 'pending'))
+    for row in spent:
+        Profile.objects.using(db_alias).filter(user_id=row['buyer_id']).update(
+            purchase_count=row['purchases'],
+            total_spent=row['spent'] or Decimal('0.00'),
+            pending_returns=pending.get(row['buyer_id'], 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_purchase_buyer_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='pending_returns',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='purchase_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='total_spent',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_summary, migrations.RunPython.noop),
+    ]
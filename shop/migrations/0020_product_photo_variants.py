@@ -0,0 +1,28 @@
+# Generated by Django 2.2 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_profile_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='photo_card',
+            field=models.FileField(blank=True, editable=False, upload_to='shop/product_image/variants/'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='photo_thumb',
+            field=models.FileField(blank=True, editable=False, upload_to='shop/product_image/variants/'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='photo_webp',
+            field=models.FileField(blank=True, editable=False, upload_to='shop/product_image/variants/'),
+        ),
+    ]
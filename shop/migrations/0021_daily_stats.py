@@ -0,0 +1,46 @@
+# Generated by Django 2.2 on 2026-10-18 11:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shop', '0020_product_photo_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('units_returned', models.PositiveIntegerField(default=0)),
+                ('refunds', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('returns_rejected', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='shop.Product')),
+            ],
+            options={
+                'unique_together': {('day', 'product')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyBuyerStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('purchases', models.PositiveIntegerField(default=0)),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('refunded', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('buyer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('day', 'buyer')},
+            },
+        ),
+    ]
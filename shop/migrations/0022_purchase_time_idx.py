@@ -0,0 +1,17 @@
+# Generated by Django 2.2 on 2026-10-18 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0021_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['time'], name='purchase_time_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 2.2 on 2026-10-18 11:14
+
+import datetime
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def fill_return_state(apps, schema_editor):
+    Purchase = apps.get_model('shop', 'Purchase')
+    purchases = Purchase.objects.using(schema_editor.connection.alias)
+
+    # every product had the fixed 3 minutes window so far
+    window = datetime.timedelta(minutes=3)
+    if schema_editor.connection.vendor == 'sqlite':
+        # date arithmetic in SQLite writes deadlines in a different text format
+        batch = []
+        for purchase in purchases.only('pk', 'time').iterator(chunk_size=2000):
+            purchase.return_deadline = purchase.time + window
+            batch.append(purchase)
+            if len(batch) == 2000:
+                purchases.bulk_update(batch, ['return_deadline'])
+                batch = []
+        purchases.bulk_update(batch, ['return_deadline'])
+    else:
+        purchases.update(return_deadline=F('time') + window)
+    purchases.filter(return_status=False).update(return_state='rejected')
+    purchases.filter(return_status=True, purchase__isnull=False).update(return_state='requested')
+    purchases.filter(return_state='returnable', return_deadline__lte=timezone.now()).update(return_state='expired')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0022_purchase_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='return_window',
+            field=models.DurationField(default=datetime.timedelta(seconds=180)),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='return_deadline',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='return_state',
+            field=models.CharField(choices=[('returnable', 'Returnable'), ('requested', 'Return requested'), ('rejected', 'Return rejected'), ('expired', 'Return time over')], default='returnable', max_length=10),
+        ),
+        migrations.RunPython(fill_return_state, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='purchase',
+            name='return_deadline',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['return_state', 'return_deadline'], name='purchase_return_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2 on 2026-10-18 11:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def opening_balances(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    LedgerEvent = apps.get_model('shop', 'LedgerEvent')
+    Product = apps.get_model('shop', 'Product')
+    Profile = apps.get_model('shop', 'Profile')
+
+    events = [LedgerEvent(kind='opening', product_id=pk, stock_delta=count)
+              for pk, count in Product.objects.using(db_alias).values_list('pk', 'count').iterator()]
+    events += [LedgerEvent(kind='opening', user_id=user_id, cash_delta=cash)
+               for user_id, cash in Profile.objects.using(db_alias).values_list('user_id', 'cash').iterator()]
+    LedgerEvent.objects.using(db_alias).bulk_create(events, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shop', '0023_return_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('kind', models.CharField(choices=[('opening', 'Opening balance'), ('adjust', 'Manual change'), ('purchase', 'Purchase'), ('refund', 'Refund'), ('restock', 'Restock')], max_length=10)),
+                ('stock_delta', models.IntegerField(default=0)),
+                ('cash_delta', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.Product')),
+                ('user', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'key')},
+            },
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+
+# full-text index of product name and description, rowid / product_id is the
+# product pk. prefix='2 3' keeps 'po*' and 'pot*' lookups in the index
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE shop_product_fts USING fts5("
+    "name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "INSERT INTO shop_product_fts (rowid, name, description) SELECT id, name, description FROM shop_product",
+]
+SQLITE_DROP = ['DROP TABLE IF EXISTS shop_product_fts']
+
+POSTGRES_CREATE = [
+    'CREATE TABLE shop_product_search ('
+    'product_id integer PRIMARY KEY REFERENCES shop_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+    'document tsvector NOT NULL)',
+    'CREATE INDEX shop_product_search_document_idx ON shop_product_search USING gin (document)',
+    "INSERT INTO shop_product_search (product_id, document) "
+    "SELECT id, setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', description), 'B') "
+    "FROM shop_product",
+]
+POSTGRES_DROP = ['DROP TABLE IF EXISTS shop_product_search']
+
+
+def fts5_available(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_index(apps, schema_editor):
+    # sqlite builds without FTS5 keep the LIKE fallback of shop.search
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        statements = POSTGRES_CREATE
+    elif connection.vendor == 'sqlite' and fts5_available(connection):
+        statements = SQLITE_CREATE
+    else:
+        return
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    statements = POSTGRES_DROP if schema_editor.connection.vendor == 'postgresql' else SQLITE_DROP
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0024_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2 on 2026-10-18 12:04
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0026_stock_hold'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='purchase',
+            name='count',
+            field=models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AlterField(
+            model_name='stockhold',
+            name='count',
+            field=models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -1,13 +1,46 @@
+from datetime import timedelta
 from decimal import Decimal
 from django.core.validators import MinValueValidator
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.timezone import localtime
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 
-class Profile(models.Model):
+class LoadedValues:
+    """ keeps loaded_fields as read from the database (and as last saved) in
+    loaded_values, so save receivers see what changed without a SELECT.
+    Unsaved instances and deferred fields have no entry """
+
+    loaded_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self.remember_values(fields)
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        super().save(force_insert, force_update, using, update_fields)
+        self.remember_values(update_fields)
+
+    def remember_values(self, fields=None):
+        if not hasattr(self, 'loaded_values'):
+            self.loaded_values = {}
+        deferred = self.get_deferred_fields()
+        for name in self.loaded_fields:
+            if name not in deferred and (fields is None or name in fields):
+                field = self._meta.get_field(name)
+                self.loaded_values[name] = field.get_prep_value(field.value_from_object(self))
+
+
+class Profile(LoadedValues, models.Model):
     user = models.OneToOneField(to=User, on_delete=models.CASCADE, related_name='profile')
     cash = models.DecimalField(
         decimal_places=2,
@@ -15,6 +48,12 @@ class Profile(models.Model):
         default=10000.00,
         validators=[MinValueValidator(Decimal('0.00'))]
     )
+    # account summary, kept up to date by shop.checkout and shop.returns
+    purchase_count = models.PositiveIntegerField(default=0)
+    total_spent = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    pending_returns = models.PositiveIntegerField(default=0)
+
+    loaded_fields = ('cash',)
 
     def __str__(self):
         return self.user.username
@@ -22,16 +61,14 @@ class Profile(models.Model):
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
+    """ new users get a profile. Later User saves (last_login on every login)
+    leave it alone, Profile changes are saved by whoever makes them """
+
     if created:
         Profile.objects.create(user=instance)
 
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
-
-
-class Product(models.Model):
+class Product(LoadedValues, models.Model):
     name = models.CharField(max_length=50)
     description = models.CharField(max_length=256)
     price = models.DecimalField(
@@ -39,21 +76,68 @@ class Product(models.Model):
         max_digits=12,
         validators=[MinValueValidator(Decimal('0.00'))])
     photo = models.FileField(upload_to='shop/product_image/')
+    # resized copies of photo made by shop.images, empty until ready or for svg
+    photo_card = models.FileField(upload_to='shop/product_image/variants/', blank=True, editable=False)
+    photo_thumb = models.FileField(upload_to='shop/product_image/variants/', blank=True, editable=False)
+    photo_webp = models.FileField(upload_to='shop/product_image/variants/', blank=True, editable=False)
     count = models.PositiveIntegerField()
+    # units of count kept for buyers by unexpired StockHolds, see shop.holds
+    reserved = models.PositiveIntegerField(default=0, editable=False)
+    # how long after buying a purchase of the product can be returned
+    return_window = models.DurationField(default=timedelta(minutes=3))
+
+    loaded_fields = ('count', 'photo')
 
     def __str__(self):
         return f"{self.pk} {self.name}"
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # reserved is kept by shop.holds with queryset updates, form and admin
+        # saves of a row loaded before a hold must not write it back
+        if update_fields is None and not self._state.adding and not force_insert:
+            deferred = self.get_deferred_fields()
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.name != 'reserved'
+                             and field.attname not in deferred]
+        super().save(force_insert, force_update, using, update_fields)
+
+    @property
+    def available(self):
+        return self.count - self.reserved
+
 
 class Purchase(models.Model):
+    RETURNABLE = 'returnable'
+    REQUESTED = 'requested'
+    REJECTED = 'rejected'
+    EXPIRED = 'expired'
+    RETURN_STATES = (
+        (RETURNABLE, 'Returnable'),
+        (REQUESTED, 'Return requested'),
+        (REJECTED, 'Return rejected'),
+        (EXPIRED, 'Return time over'),
+    )
+
     buyer = models.ForeignKey(User, on_delete=models.DO_NOTHING)
     product = models.ForeignKey(
         to=Product,
         on_delete=models.DO_NOTHING,
         related_name='product')
-    count = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     time = models.DateTimeField(auto_now_add=True)
+    # False once a return was rejected, kept next to return_state
     return_status = models.BooleanField(default=True)
+    return_state = models.CharField(max_length=10, choices=RETURN_STATES, default=RETURNABLE)
+    return_deadline = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['buyer', '-time'], name='purchase_buyer_time_idx'),
+            # admin date hierarchy and filters, export date ranges
+            models.Index(fields=['time'], name='purchase_time_idx'),
+            # batches of shop.returns.expire
+            models.Index(fields=['return_state', 'return_deadline'], name='purchase_return_expiry_idx'),
+        ]
 
     def __str__(self):
         time = localtime(self.time).strftime("%Y-%m-%d %H:%M:%S")
@@ -67,3 +151,84 @@ class Return(models.Model):
         primary_key=True,
         related_name='purchase')
     post_time = models.DateTimeField(auto_now_add=True)
+
+
+class StockHold(models.Model):
+    """ count units of product kept for user until expires, see shop.holds """
+
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='holds')
+    product = models.ForeignKey(to=Product, on_delete=models.CASCADE, related_name='holds')
+    count = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    created = models.DateTimeField(auto_now_add=True)
+    # batches of shop.holds.expire
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user.username} HOLD {self.product.name} ({self.count})"
+
+
+class DailyProductStats(models.Model):
+    """ per product per day sales and returns, maintained by shop.stats """
+
+    day = models.DateField()
+    product = models.ForeignKey(to=Product, on_delete=models.CASCADE, related_name='daily_stats')
+    units_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(decimal_places=2, max_digits=14, default=0)
+    units_returned = models.PositiveIntegerField(default=0)
+    refunds = models.DecimalField(decimal_places=2, max_digits=14, default=0)
+    returns_rejected = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('day', 'product')]
+
+
+class DailyBuyerStats(models.Model):
+    """ per buyer per day spend, maintained by shop.stats """
+
+    day = models.DateField()
+    buyer = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='daily_stats')
+    purchases = models.PositiveIntegerField(default=0)
+    spent = models.DecimalField(decimal_places=2, max_digits=14, default=0)
+    refunded = models.DecimalField(decimal_places=2, max_digits=14, default=0)
+
+    class Meta:
+        unique_together = [('day', 'buyer')]
+
+
+class IdempotencyKey(models.Model):
+    """ client keys of processed purchase/return submissions, see shop.idempotency """
+
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=64)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = [('user', 'key')]
+
+
+class LedgerEvent(models.Model):
+    """ append-only log of stock and cash changes, written by shop.ledger.
+    Product.count and Profile.cash are the sums of their events """
+
+    OPENING = 'opening'
+    ADJUST = 'adjust'
+    PURCHASE = 'purchase'
+    REFUND = 'refund'
+    RESTOCK = 'restock'
+    KINDS = (
+        (OPENING, 'Opening balance'),
+        (ADJUST, 'Manual change'),
+        (PURCHASE, 'Purchase'),
+        (REFUND, 'Refund'),
+        (RESTOCK, 'Restock'),
+    )
+
+    time = models.DateTimeField(default=timezone.now)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    # history outlives users and products, no constraints
+    user = models.ForeignKey(to=User, on_delete=models.DO_NOTHING, db_constraint=False,
+                             null=True, related_name='+')
+    product = models.ForeignKey(to=Product, on_delete=models.DO_NOTHING, db_constraint=False,
+                                null=True, related_name='+')
+    stock_delta = models.IntegerField(default=0)
+    cash_delta = models.DecimalField(decimal_places=2, max_digits=14, default=0)
@@ -0,0 +1,91 @@
+from django.core import signing
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class CursorPage:
+    """ one page of keyset pagination, no COUNT(*) needed """
+
+    def __init__(self, object_list, next_cursor, prev_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+class CursorPaginator:
+    """ keyset paginator. Example: ordering=('-time', '-pk')
+
+    Pages are addressed by opaque signed tokens holding the ordering values
+    of the edge row, so page N costs the same index seek as page 1.
+    The last ordering field must be unique (pk) to break ties.
+    """
+
+    salt = 'shop.pagination.cursor'
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+    def encode(self, obj, direction):
+        values = [str(getattr(obj, field)) for field, _ in self.ordering]
+        return signing.dumps([direction, values], salt=self.salt, compress=True)
+
+    def decode(self, cursor):
+        try:
+            direction, values = signing.loads(cursor, salt=self.salt)
+        except (signing.BadSignature, ValueError, TypeError):
+            raise InvalidCursor('Invalid cursor')
+        if direction not in ('next', 'prev') or len(values) != len(self.ordering):
+            raise InvalidCursor('Invalid cursor')
+        return direction, values
+
+    def seek(self, values, backwards):
+        """ WHERE (a, b) > (x, y) spelled out as OR-ed prefixes """
+
+        condition = Q()
+        for index, (field, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != backwards else 'gt'
+            prefix = {name: value for (name, _), value in zip(self.ordering[:index], values)}
+            condition |= Q(**prefix, **{f'{field}__{lookup}': values[index]})
+        return condition
+
+    def order_by(self, backwards):
+        return [('-' if descending != backwards else '') + field
+                for field, descending in self.ordering]
+
+    def page(self, cursor):
+        direction, values = self.decode(cursor)
+        backwards = direction == 'prev'
+        qs = self.queryset.filter(self.seek(values, backwards)).order_by(*self.order_by(backwards))
+        return self._page(qs, backwards, has_prev=True)
+
+    def _page(self, qs, backwards, has_prev):
+        rows = list(qs[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next = has_more
+
+        next_cursor = self.encode(rows[-1], 'next') if rows and has_next else None
+        prev_cursor = self.encode(rows[0], 'prev') if rows and has_prev else None
+        return CursorPage(rows, next_cursor, prev_cursor)
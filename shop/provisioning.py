@@ -0,0 +1,59 @@
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from shop import ledger
+from shop import models
+
+BATCH_SIZE = 1000
+
+
+def _batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def provision(accounts, password=None, batch_size=BATCH_SIZE):
+    """ create users with their profiles from (username, email, cash) tuples,
+    cash None for the Profile default, in one transaction.
+
+    bulk_create sends no post_save, so profiles and their opening ledger
+    events are inserted here, a batch costs five queries whatever its size.
+    password is hashed once for all of them, None gives unusable passwords
+    (users set theirs with a password reset). Existing usernames are left
+    alone. Returns (created count, skipped usernames).
+    """
+
+    password = make_password(password)
+    cash_field = models.Profile._meta.get_field('cash')
+    created, skipped = 0, []
+    with transaction.atomic():
+        for batch in _batches(accounts, batch_size):
+            existing = set(User.objects
+                           .filter(username__in=[username for username, _, _ in batch])
+                           .values_list('username', flat=True))
+            skipped += [username for username, _, _ in batch if username in existing]
+            batch = [account for account in batch if account[0] not in existing]
+            if not batch:
+                continue
+
+            User.objects.bulk_create([User(username=username, email=email, password=password)
+                                      for username, email, _ in batch])
+            # SQLite doesn't return bulk inserted keys
+            pks = dict(User.objects
+                       .filter(username__in=[username for username, _, _ in batch])
+                       .values_list('username', 'pk'))
+            cash = {pks[username]: cash_field.to_python(cash_field.default if cash is None else cash)
+                    for username, _, cash in batch}
+            models.Profile.objects.bulk_create([models.Profile(user_id=pk, cash=amount)
+                                                for pk, amount in cash.items()])
+            ledger.record([models.LedgerEvent(kind=models.LedgerEvent.OPENING, user_id=pk, cash_delta=amount)
+                           for pk, amount in cash.items() if amount])
+            created += len(batch)
+    return created, skipped
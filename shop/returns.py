@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from shop import account
+from shop import catalogue
+from shop import idempotency
+from shop import ledger
+from shop import models
+from shop import stats
+
+logger = logging.getLogger('shop.returns')
+
+BATCH_SIZE = 5000
+
+RETURN_FIELDS = {
+    'buyer_id': F('purchase__buyer_id'),
+    'username': F('purchase__buyer__username'),
+    'product_id': F('purchase__product_id'),
+    'product_name': F('purchase__product__name'),
+    'count': F('purchase__count'),
+    'price': F('purchase__product__price'),
+}
+
+
+def _per_buyer(field, deltas, sign):
+    """ CASE expression adding deltas[user_id] * sign to Profile field """
+
+    return Case(*[When(user_id=user_id, then=F(field) + delta * sign)
+                  for user_id, delta in deltas.items()],
+                default=F(field))
+
+
+def _load(purchase_pks):
+    """ rows of the returns, locked by a no-op UPDATE first like holds._claim:
+    on SQLite a transaction that read first can't wait for the write lock, so
+    concurrent approvals would fail with 'database is locked' instead of queuing """
+
+    pending = models.Return.objects.filter(pk__in=purchase_pks)
+    pending.update(post_time=F('post_time'))
+    return list(pending.values('purchase_id', **RETURN_FIELDS))
+
+
+def request(purchase, idempotency_key=None):
+    """ buyer asks to return purchase, IntegrityError if it is not returnable
+    (already asked, rejected or expired), idempotency.AlreadyProcessed when
+    idempotency_key was used before """
+
+    with transaction.atomic():
+        idempotency.claim(purchase.buyer_id, idempotency_key)
+        if not (models.Purchase.objects
+                .filter(pk=purchase.pk, return_state=models.Purchase.RETURNABLE,
+                        return_deadline__gt=timezone.now())
+                .update(return_state=models.Purchase.REQUESTED)):
+            raise IntegrityError(f'purchase {purchase.pk} is not returnable')
+        models.Return.objects.create(purchase=purchase)
+        (models.Profile.objects.filter(user_id=purchase.buyer_id)
+         .update(pending_returns=F('pending_returns') + 1))
+        account.invalidate(purchase.buyer_id)
+
+
+def approve(purchase_pks):
+    """ accept returns: refund buyers, restock products, delete purchases.
+
+    Refunds and restocks are summed per buyer and per product and written
+    with one CASE update each, so the number of queries does not depend on
+    how many returns are approved. Returns the processed rows with 'total'.
+    """
+
+    with transaction.atomic():
+        rows = _load(purchase_pks)
+        refunds = defaultdict(Decimal)
+        returned = defaultdict(int)
+        restock = defaultdict(int)
+        for row in rows:
+            row['total'] = row['price'] * row['count']
+            refunds[row['buyer_id']] += row['total']
+            returned[row['buyer_id']] += 1
+            restock[row['product_id']] += row['count']
+
+        if rows:
+            models.Profile.objects.filter(user_id__in=refunds).update(
+                cash=_per_buyer('cash', refunds, 1),
+                total_spent=_per_buyer('total_spent', refunds, -1),
+                purchase_count=_per_buyer('purchase_count', returned, -1),
+                pending_returns=_per_buyer('pending_returns', returned, -1))
+            account.invalidate(*refunds)
+            models.Product.objects.filter(pk__in=restock).update(
+                count=Case(*[When(pk=pk, then=F('count') + count) for pk, count in restock.items()],
+                           default=F('count')))
+            stats.record_refunds(rows)
+            ledger.record([models.LedgerEvent(kind=models.LedgerEvent.REFUND, user_id=row['buyer_id'],
+                                              product_id=row['product_id'], stock_delta=row['count'],
+                                              cash_delta=row['total'])
+                           for row in rows])
+
+            # Return rows go with their purchases (on_delete=CASCADE)
+            models.Purchase.objects.filter(pk__in=[row['purchase_id'] for row in rows]).delete()
+            transaction.on_commit(lambda: [catalogue.invalidate_product(pk) for pk in restock])
+    return rows
+
+
+def refund(purchase_pks):
+    """ admin refund of purchases, whether the buyer asked for a return or not """
+
+    with transaction.atomic():
+        purchases = models.Purchase.objects.filter(pk__in=purchase_pks)
+        purchases.update(count=F('count'))  # write lock before the read, see _load
+        unasked = list(purchases.filter(purchase__isnull=True).values_list('pk', 'buyer_id'))
+        if unasked:
+            (models.Purchase.objects.filter(pk__in=[pk for pk, _ in unasked])
+             .update(return_state=models.Purchase.REQUESTED))
+            models.Return.objects.bulk_create([models.Return(purchase_id=pk) for pk, _ in unasked])
+            asked = defaultdict(int)
+            for _, buyer_id in unasked:
+                asked[buyer_id] += 1
+            models.Profile.objects.filter(user_id__in=asked).update(
+                pending_returns=_per_buyer('pending_returns', asked, 1))
+        return approve(purchase_pks)
+
+
+def reject(purchase_pks):
+    """ refuse returns: purchase stays with buyer and can't be returned again """
+
+    with transaction.atomic():
+        rows = _load(purchase_pks)
+        if rows:
+            done = [row['purchase_id'] for row in rows]
+            models.Purchase.objects.filter(pk__in=done).update(
+                return_status=False, return_state=models.Purchase.REJECTED)
+            models.Return.objects.filter(pk__in=done).delete()
+
+            rejected = defaultdict(int)
+            for row in rows:
+                rejected[row['buyer_id']] += 1
+            models.Profile.objects.filter(user_id__in=rejected).update(
+                pending_returns=_per_buyer('pending_returns', rejected, -1))
+            account.invalidate(*rejected)
+            stats.record_rejections(rows)
+    return rows
+
+
+def expire(batch_size=BATCH_SIZE, now=None):
+    """ returnable purchases past their deadline become expired, batch_size
+    rows per UPDATE over the (return_state, return_deadline) index.
+    Returns the number of expired purchases """
+
+    now = now or timezone.now()
+    stale = models.Purchase.objects.filter(return_state=models.Purchase.RETURNABLE, return_deadline__lte=now)
+    expired = 0
+    while True:
+        pks = list(stale.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return expired
+        # a return requested meanwhile keeps its state
+        expired += stale.filter(pk__in=pks).update(return_state=models.Purchase.EXPIRED)
+
+
+def start_expiry(interval):
+    """ in-process scheduler: expire() every interval seconds in a daemon thread """
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                expire()
+            except Exception:
+                logger.exception('return expiry failed')
+            finally:
+                connection.close()
+
+    thread = threading.Thread(target=run, name='shop-return-expiry', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,122 @@
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SESSION_KEY = 'shop_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+# logins must be found right after they are made, whatever the replica lag
+PRIMARY_APPS = ('auth', 'sessions', 'contenttypes')
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'SHOP_DB_REPLICAS', [])
+
+
+def replica():
+    """ alias of a random replica, DEFAULT_DB_ALIAS when there is none """
+
+    aliases = replicas()
+    return random.choice(aliases) if aliases else DEFAULT_DB_ALIAS
+
+
+def pinned(request):
+    """ True while the session is in its sticky window after a write """
+
+    session = getattr(request, 'session', None)
+    return session is not None and session.get(SESSION_KEY, 0) > time.time()
+
+
+def sticky_seconds():
+    return getattr(settings, 'SHOP_REPLICA_STICKY_SECONDS', 10)
+
+
+def pin(request):
+    request.session[SESSION_KEY] = time.time() + sticky_seconds()
+
+
+def reading_primary():
+    """ False inside replica_reads() that picked a replica """
+
+    return getattr(_state, 'alias', None) in (None, DEFAULT_DB_ALIAS)
+
+
+def read_alias(request):
+    """ database for the reads of request: a replica, or the primary while pinned """
+
+    return DEFAULT_DB_ALIAS if pinned(request) else replica()
+
+
+@contextmanager
+def replica_reads(request):
+    """ reads of this thread go to one replica (the same for the whole block) """
+
+    previous = getattr(_state, 'alias', None)
+    _state.alias = read_alias(request)
+    try:
+        yield _state.alias
+    finally:
+        _state.alias = previous
+
+
+class ReplicaReads:
+    """ view mixin: GET reads of the view and of its template go to a replica,
+    unless the session wrote within SHOP_REPLICA_STICKY_SECONDS. Routed by
+    StickyPrimaryMiddleware, which keeps the replica until the response is
+    rendered (querysets are lazy) """
+
+
+class StickyPrimaryMiddleware:
+    """ a POST (purchase, return, hold, ...) pins the session to the primary,
+    so the next pages read their own writes while replicas catch up.
+
+    Safe requests of ReplicaReads views read a replica from process_view until
+    the handler has rendered the response, the render stays where
+    MetricsMiddleware measures it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            reads = getattr(request, '_replica_reads', None)
+            if reads is not None:
+                reads.close()
+        if request.method not in SAFE_METHODS and replicas() and hasattr(request, 'session'):
+            pin(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        if request.method in SAFE_METHODS and view_class and issubclass(view_class, ReplicaReads):
+            request._replica_reads = ExitStack()
+            request._replica_reads.enter_context(replica_reads(request))
+
+
+class PrimaryReplicaRouter:
+    """ writes always go to the primary; reads go to a replica only inside
+    replica_reads(), everything else reads the primary as before """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return None
+        return getattr(_state, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema by replication (or sync_sqlite_replica)
+        return db not in replicas()
@@ -0,0 +1,173 @@
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count, F, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from shop import catalogue
+from shop import models
+
+MAX_TERMS = 8
+
+# facet key -> (label, price from, price below)
+PRICE_RANGES = {
+    'under-10': ('under 10 ₴', None, 10),
+    '10-50': ('10 - 50 ₴', 10, 50),
+    '50-100': ('50 - 100 ₴', 50, 100),
+    'over-100': ('over 100 ₴', 100, None),
+}
+
+# one index per backend (created by migration 0025), rowid / product_id is the product pk
+SQLITE_TABLE = 'shop_product_fts'
+POSTGRES_TABLE = 'shop_product_search'
+POSTGRES_DOCUMENT = ("setweight(to_tsvector('simple', {name}), 'A') || "
+                     "setweight(to_tsvector('simple', {description}), 'B')")
+
+
+_backends = {}
+
+
+def _backend(using=DEFAULT_DB_ALIAS):
+    """ 'sqlite', 'postgresql' or None when there is no index to query """
+
+    if using not in _backends:
+        connection = connections[using]
+        table = {'sqlite': SQLITE_TABLE, 'postgresql': POSTGRES_TABLE}.get(connection.vendor)
+        found = table is not None and table in connection.introspection.table_names()
+        _backends[using] = connection.vendor if found else None
+    return _backends[using]
+
+
+def index(product, using=DEFAULT_DB_ALIAS):
+    backend = _backend(using)
+    if backend is None:
+        return
+    with connections[using].cursor() as cursor:
+        if backend == 'sqlite':
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(f'INSERT INTO {SQLITE_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+                           [product.pk, product.name, product.description])
+        else:
+            cursor.execute(f'INSERT INTO {POSTGRES_TABLE} (product_id, document) '
+                           f'VALUES (%s, {POSTGRES_DOCUMENT.format(name="%s", description="%s")}) '
+                           f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                           [product.pk, product.name, product.description])
+
+
+def remove(pk, using=DEFAULT_DB_ALIAS):
+    backend = _backend(using)
+    if backend is None:
+        return
+    table, column = (SQLITE_TABLE, 'rowid') if backend == 'sqlite' else (POSTGRES_TABLE, 'product_id')
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} = %s', [pk])
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """ index every product again, for rows written with bulk_create or update() """
+
+    backend = _backend(using)
+    if backend is None:
+        return
+    with connections[using].cursor() as cursor:
+        if backend == 'sqlite':
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+            cursor.execute(f'INSERT INTO {SQLITE_TABLE} (rowid, name, description) '
+                           f'SELECT id, name, description FROM shop_product')
+        else:
+            cursor.execute(f'DELETE FROM {POSTGRES_TABLE}')
+            cursor.execute(f'INSERT INTO {POSTGRES_TABLE} (product_id, document) '
+                           f'SELECT id, {POSTGRES_DOCUMENT.format(name="name", description="description")} '
+                           f'FROM shop_product')
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def search(query, using=None):
+    """ products matching every word of query as a prefix, best first.
+    Without words all products by price. Read from using, or the database
+    the router picks (a replica inside routers.replica_reads()) """
+
+    products = models.Product.objects.all() if using is None else models.Product.objects.using(using)
+    words = terms(query)
+    if not words:
+        return products.order_by('price', 'pk')
+
+    backend = _backend(products.db)
+    if backend == 'sqlite':
+        return products.extra(
+            tables=[SQLITE_TABLE],
+            where=[f'{SQLITE_TABLE}.rowid = shop_product.id', f'{SQLITE_TABLE} MATCH %s'],
+            params=[' '.join(f'"{word}"*' for word in words)],
+            # bm25 is lower for better matches, a name hit weighs 10 description hits
+            select={'rank': f'bm25({SQLITE_TABLE}, 10.0, 1.0)'},
+            order_by=['rank', 'shop_product.id'])
+    if backend == 'postgresql':
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        return products.extra(
+            tables=[POSTGRES_TABLE],
+            where=[f'{POSTGRES_TABLE}.product_id = shop_product.id',
+                   f"{POSTGRES_TABLE}.document @@ to_tsquery('simple', %s)"],
+            params=[tsquery],
+            select={'rank': f"ts_rank({POSTGRES_TABLE}.document, to_tsquery('simple', %s))"},
+            select_params=[tsquery],
+            order_by=['-rank', 'shop_product.id'])
+
+    # no index: slow but correct
+    for word in words:
+        products = products.filter(Q(name__icontains=word) | Q(description__icontains=word))
+    return products.order_by('price', 'pk')
+
+
+def _price_q(key):
+    _, low, high = PRICE_RANGES[key]
+    q = Q()
+    if low is not None:
+        q &= Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
+
+def narrow(products, price=None, in_stock=False):
+    """ apply selected facets to search() result """
+
+    if price:
+        products = products.filter(_price_q(price))
+    if in_stock:
+        products = products.filter(count__gt=F('reserved'))
+    return products
+
+
+def facets(query, using=None):
+    """ {'total', 'in_stock', 'price': {key: count}} for the words of query,
+    one aggregate per query, kept in the catalogue cache until any product changes """
+
+    using = using or models.Product.objects.db
+    words = terms(query)
+    key = catalogue.page_key('search-facets', using, *words)
+    counts = catalogue.get_page(key)
+    if counts is None:
+        aggregates = {f'price_{price}': Count('pk', filter=_price_q(price)) for price in PRICE_RANGES}
+        aggregates['in_stock'] = Count('pk', filter=Q(count__gt=F('reserved')))
+        aggregates['total'] = Count('pk')
+        row = search(' '.join(words), using).order_by().aggregate(**aggregates)
+        counts = {'total': row['total'], 'in_stock': row['in_stock'],
+                  'price': {price: row[f'price_{price}'] for price in PRICE_RANGES}}
+        catalogue.set_page(key, counts)
+    return counts
+
+
+@receiver(post_save, sender=models.Product)
+def product_saved(sender, instance, update_fields=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    if update_fields is not None and not {'name', 'description'} & set(update_fields):
+        return
+    index(instance, using)
+
+
+@receiver(post_delete, sender=models.Product)
+def product_deleted(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    remove(instance.pk, using)
@@ -0,0 +1,96 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from shop import models
+
+BATCH_SIZE = 5000
+
+
+def _add(model, key, day, deltas):
+    """ upsert rollup rows of day: create missing (day, key) rows, then add
+    deltas[key value][field] with one CASE update for all of them """
+
+    if not deltas:
+        return
+    model.objects.bulk_create([model(day=day, **{key: pk}) for pk in deltas], ignore_conflicts=True)
+    fields = {field for values in deltas.values() for field in values}
+    model.objects.filter(day=day, **{f'{key}__in': list(deltas)}).update(**{
+        field: Case(*[When(**{key: pk}, then=F(field) + values[field])
+                      for pk, values in deltas.items() if field in values],
+                    default=F(field))
+        for field in fields})
+
+
+def _lines(lines, day, product_fields, buyer_fields):
+    """ sum (buyer_id, product_id, count, total) lines into product (units,
+    money) and buyer (line count or None, money) fields of day """
+
+    units, product_money = product_fields
+    buyer_lines, buyer_money = buyer_fields
+    products = defaultdict(lambda: {units: 0, product_money: 0})
+    buyers = defaultdict(lambda: {buyer_money: 0})
+    for buyer_id, product_id, count, total in lines:
+        products[product_id][units] += count
+        products[product_id][product_money] += total
+        buyers[buyer_id][buyer_money] += total
+        if buyer_lines:
+            buyers[buyer_id][buyer_lines] = buyers[buyer_id].get(buyer_lines, 0) + 1
+
+    day = day or timezone.localdate()
+    _add(models.DailyProductStats, 'product_id', day, products)
+    _add(models.DailyBuyerStats, 'buyer_id', day, buyers)
+
+
+def record_sales(lines, day=None):
+    """ (buyer_id, product_id, count, total) lines bought on day (today) """
+
+    _lines(lines, day, ('units_sold', 'revenue'), ('purchases', 'spent'))
+
+
+def record_refunds(rows, day=None):
+    """ rows of returns.approve refunded on day (today) """
+
+    refunds = [(row['buyer_id'], row['product_id'], row['count'], row['total']) for row in rows]
+    _lines(refunds, day, ('units_returned', 'refunds'), (None, 'refunded'))
+
+
+def record_rejections(rows, day=None):
+    """ rows of returns.reject rejected on day (today) """
+
+    rejected = defaultdict(lambda: {'returns_rejected': 0})
+    for row in rows:
+        rejected[row['product_id']]['returns_rejected'] += 1
+    _add(models.DailyProductStats, 'product_id', day or timezone.localdate(), rejected)
+
+
+def backfill(chunk_size=BATCH_SIZE):
+    """ add sales of Purchase history to the rollups, chunk_size purchases per
+    transaction, yields the number of purchases done so far.
+
+    Approved returns delete their purchases and rejections are not dated,
+    so history before the rollups existed has no refunds or rejections.
+    """
+
+    done = last_pk = 0
+    while True:
+        chunk = list(models.Purchase.objects
+                     .filter(pk__gt=last_pk)
+                     .order_by('pk')
+                     .values_list('pk', 'buyer_id', 'product_id', 'count', 'time', 'product__price')
+                     [:chunk_size])
+        if not chunk:
+            return
+
+        by_day = defaultdict(list)
+        for pk, buyer_id, product_id, count, time, price in chunk:
+            by_day[timezone.localdate(time)].append((buyer_id, product_id, count, price * count))
+        with transaction.atomic():
+            for day, lines in by_day.items():
+                record_sales(lines, day)
+
+        last_pk = chunk[-1][0]
+        done += len(chunk)
+        yield done
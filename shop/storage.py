@@ -0,0 +1,63 @@
+import gzip
+import logging
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # optional, gzip copies only
+    brotli = None
+
+logger = logging.getLogger('shop.storage')
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.ico', '.map')
+
+
+def compress(content):
+    """ yield (extension, compressed bytes) worth keeping next to content """
+
+    gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(gzipped) < len(content):
+        yield '.gz', gzipped
+    if brotli is not None:
+        brotlied = brotli.compress(content)
+        if len(brotlied) < len(content):
+            yield '.br', brotlied
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ hashed file names plus precompressed .gz/.br copies made by collectstatic """
+
+    def url_converter(self, name, hashed_files, template=None):
+        converter = super().url_converter(name, hashed_files, template)
+
+        def keep_missing(matchobj):
+            # vendored css may point at files that were never shipped
+            try:
+                return converter(matchobj)
+            except ValueError as error:
+                logger.warning('%s: %s', name, error)
+                return matchobj.group(0)
+
+        return keep_missing
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_files = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name:
+                hashed_files.add(hashed_name)
+            yield name, hashed_name, processed
+
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_files):
+            if not hashed_name.endswith(COMPRESSIBLE):
+                continue
+            with self.open(hashed_name) as original:
+                content = original.read()
+            for extension, compressed in compress(content):
+                compressed_name = hashed_name + extension
+                if self.exists(compressed_name):
+                    self.delete(compressed_name)
+                self._save(compressed_name, ContentFile(compressed))
@@ -0,0 +1,123 @@
+import uuid
+from functools import lru_cache
+
+from django import template
+from django.templatetags.static import static
+from django.urls import get_script_prefix, reverse
+
+register = template.Library()
+
+ALT_IMAGE = 'images/alt.svg'
+# reversed in place of a pk once per process, rows put their own pk in
+PK_PLACEHOLDER = 4294967295
+
+
+@register.simple_tag
+def idempotency_key():
+    """ fresh key for one submission of one form, see shop.idempotency """
+
+    return uuid.uuid4().hex
+
+
+@lru_cache(maxsize=None)
+def static_url(path):
+    """ static(path) resolved once per process, hashed names of the manifest
+    storage don't change under a running worker """
+
+    return static(path)
+
+
+@register.simple_tag
+def alt_image():
+    """ url of the picture shown when a product photo fails to load """
+
+    return static_url(ALT_IMAGE)
+
+
+@lru_cache(maxsize=None)
+def _reverse(name, script_prefix, args=()):
+    return reverse(name, args=args)
+
+
+def url(name, pk=None):
+    """ reverse(name, args=[pk]), the pattern is resolved once per process
+    instead of once per row """
+
+    if pk is None:
+        return _reverse(name, get_script_prefix())
+    return _reverse(name, get_script_prefix(), (PK_PLACEHOLDER,)).replace(str(PK_PLACEHOLDER), str(pk), 1)
+
+
+def _success_url(context):
+    # cached cards carry a placeholder, list pages the page itself
+    if 'success_url' in context:
+        return context['success_url']
+    return context['request'].get_full_path()
+
+
+def render_row(context, template_name, values):
+    """ render a per-row partial with values and the csrf token only.
+
+    The partial is loaded once per page, and gets a small Context of its own
+    instead of the copy of the whole page context that {% include %} and
+    inclusion tags push and look variables up through.
+    """
+
+    key = (__name__, template_name)
+    partial = context.render_context.get(key)
+    if partial is None:
+        partial = context.render_context[key] = context.template.engine.get_template(template_name)
+    values['csrf_token'] = context.get('csrf_token')
+    return partial.render(template.Context(values, autoescape=context.autoescape,
+                                           use_l10n=context.use_l10n, use_tz=context.use_tz))
+
+
+@register.simple_tag(takes_context=True)
+def purchase_create_form(context, product):
+    """ buy / hold form of a product card """
+
+    return render_row(context, 'shop/purchase/create_form.html', {
+        'product': product,
+        'action': url('shop:purchase_create', product.pk),
+        'hold_action': url('shop:hold_create', product.pk),
+        'success_url': _success_url(context),
+        'idempotency_key': context['idempotency_key'],
+        'purchase_create_form': context.get('purchase_create_form'),
+    })
+
+
+@register.simple_tag(takes_context=True)
+def product_update_form(context, product):
+    """ admin's update button of a product card """
+
+    return render_row(context, 'shop/product/update_button_form.html',
+                      {'action': url('shop:product_update', product.pk)})
+
+
+@register.simple_tag(takes_context=True)
+def return_create_form(context, purchase):
+    """ return request button of a purchase history row """
+
+    return render_row(context, 'shop/return/create_form.html', {
+        'purchase': purchase,
+        'now': context['now'],
+        'action': url('shop:return_create'),
+    })
+
+
+@register.simple_tag(takes_context=True)
+def purchase_delete_form(context, return_):
+    """ approve button of a return list row """
+
+    return render_row(context, 'shop/purchase/delete_form.html', {
+        'action': url('shop:purchase_delete', return_.pk),
+        'success_url': _success_url(context),
+    })
+
+
+@register.simple_tag(takes_context=True)
+def return_delete_form(context, return_):
+    """ reject button of a return list row """
+
+    return render_row(context, 'shop/return/delete_form.html',
+                      {'action': url('shop:return_delete', return_.pk)})
@@ -1,3 +1,1346 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import importlib
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.wsgi import get_wsgi_application
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DEFAULT_DB_ALIAS, connection, connections, OperationalError
+from django.http import Http404
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, set_script_prefix
+from django.utils import timezone
+from PIL import Image
+
+from base import urls as base_urls
+
+from shop import account
+from shop import asgi
+from shop import assets
+from shop import catalogue
+from shop import checkout
+from shop import export
+from shop import holds
+from shop import idempotency
+from shop import ledger
+from shop import models
+from shop import provisioning
+from shop import returns
+from shop import routers
+from shop import search
+from shop import stats
+from shop import storage
+from shop.management.commands import copy_shop_data
+from shop.metrics import registry
+from shop.templatetags import shop_tags
+
+
+def create_product(**kwargs):
+    data = {'name': 'pot', 'description': 'cooking pot', 'price': Decimal('10.00'),
+            'photo': 'shop/product_image/icons8-cooking-pot.svg', 'count': 5}
+    data.update(kwargs)
+    return models.Product.objects.create(**data)
+
+
+def create_buyer(username, cash=Decimal('1000.00')):
+    user = User.objects.create_user(username=username, password='1')
+    user.profile.cash = cash
+    user.profile.save()
+    return user
+
+
+class CheckoutTest(TestCase):
+
+    def setUp(self):
+        self.product = create_product()
+        self.buyer = create_buyer('user1', cash=Decimal('100.00'))
+
+    def test_purchase(self):
+        purchase = checkout.purchase(self.buyer, self.product.pk, 3)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.count, 2)
+        self.assertEqual(models.Profile.objects.get(user=self.buyer).cash, Decimal('70.00'))
+        self.assertEqual(purchase.buyer, self.buyer)
+        self.assertEqual(purchase.count, 3)
+
+    def test_sold_out(self):
+        with self.assertRaises(checkout.SoldOut) as error:
+            checkout.purchase(self.buyer, self.product.pk, 6)
+
+        self.assertEqual(error.exception.product.count, 5)
+        self.assertFalse(models.Purchase.objects.exists())
+
+    def test_insufficient_funds_rolls_back_stock(self):
+        models.Product.objects.filter(pk=self.product.pk).update(price=Decimal('25.00'))
+
+        with self.assertRaises(checkout.InsufficientFunds) as error:
+            checkout.purchase(self.buyer, self.product.pk, 5)
+
+        self.assertEqual(error.exception.total_cost, Decimal('125.00'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.count, 5)
+        self.assertFalse(models.Purchase.objects.exists())
+
+    def test_empty_or_zero_lines(self):
+        with self.assertNumQueries(0):
+            with self.assertRaises(ValueError):
+                checkout.purchase_many(self.buyer, [])
+            with self.assertRaises(ValueError):
+                checkout.purchase_many(self.buyer, [(self.product.pk, 1), (self.product.pk, 0)])
+
+    def test_purchase_view(self):
+        self.client.force_login(self.buyer)
+        response = self.client.post(f'/purchase_create/{self.product.pk}/', {'count': 2})
+
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertEqual(models.Purchase.objects.get().count, 2)
+
+    def test_purchase_view_unknown_product(self):
+        self.client.force_login(self.buyer)
+        response = self.client.post('/purchase_create/99999/', {'count': 1}, follow=True)
+
+        self.assertRedirects(response, '/')
+        self.assertEqual([message.level_tag for message in response.context['messages']], ['warning'])
+        self.assertFalse(models.Purchase.objects.exists())
+
+    def test_zero_count_is_rejected(self):
+        self.client.force_login(self.buyer)
+        self.client.post(f'/purchase_create/{self.product.pk}/', {'count': 0})
+        self.client.post(f'/hold_create/{self.product.pk}/', {'count': 0})
+
+        self.assertFalse(models.Purchase.objects.exists())
+        self.assertFalse(models.StockHold.objects.exists())
+        self.assertFalse(models.LedgerEvent.objects.filter(product=self.product, kind=models.LedgerEvent.PURCHASE).exists())
+
+
+@override_settings(SHOP_IMAGE_SYNC=True)
+class CheckoutStressTest(TransactionTestCase):
+    """ many buyers race for the last items of one product """
+
+    threads = 8
+    attempts = 5
+
+    def test_no_overselling(self):
+        product = create_product(count=10, price=Decimal('1.00'))
+        buyers = [create_buyer(f'user{n}') for n in range(self.threads)]
+        barrier = threading.Barrier(self.threads)
+        sold_out = []
+
+        def buy(user):
+            barrier.wait()
+            try:
+                for _ in range(self.attempts):
+                    while True:
+                        try:
+                            checkout.purchase(user, product.pk, 1)
+                        except checkout.SoldOut:
+                            sold_out.append(user.pk)
+                        except OperationalError:
+                            continue  # sqlite: database is locked, retry
+                        break
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=buy, args=(user,)) for user in buyers]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        product.refresh_from_db()
+        self.assertEqual(product.count, 0)
+        self.assertEqual(models.Purchase.objects.count(), 10)
+        self.assertEqual(len(sold_out), self.threads * self.attempts - 10)
+        spent = sum(Decimal('1000.00') - profile.cash for profile in models.Profile.objects.all())
+        self.assertEqual(spent, Decimal('10.00'))
+
+
+class PurchaseListTest(TestCase):
+
+    def test_only_own_purchases_in_constant_queries(self):
+        product = create_product(count=100)
+        buyer = create_buyer('user1')
+        other = create_buyer('user2')
+        for _ in range(5):
+            checkout.purchase(buyer, product.pk, 2)
+        checkout.purchase(other, product.pk, 1)
+        self.client.force_login(buyer)
+
+        with self.assertNumQueries(4):
+            response = self.client.get('/purchase_list/')
+
+        purchases = response.context['purchases']
+        self.assertEqual(len(purchases), 5)
+        self.assertEqual(purchases[0].total, Decimal('20.00'))
+
+
+class StockHoldTest(TestCase):
+
+    def setUp(self):
+        self.pot = create_product(count=5)
+        self.buyer = create_buyer('user1')
+        self.other = create_buyer('user2')
+
+    def test_hold_keeps_stock_from_others(self):
+        holds.hold(self.buyer, self.pot.pk, 4)
+
+        with self.assertRaises(checkout.SoldOut) as error:
+            checkout.purchase(self.other, self.pot.pk, 2)
+        self.assertEqual(error.exception.product.available, 1)
+        with self.assertRaises(checkout.SoldOut):
+            holds.hold(self.other, self.pot.pk, 2)
+        checkout.purchase(self.other, self.pot.pk, 1)
+
+        self.pot.refresh_from_db()
+        self.assertEqual((self.pot.count, self.pot.reserved), (4, 4))
+
+    def test_product_save_keeps_reserved(self):
+        pot = models.Product.objects.get(pk=self.pot.pk)
+        holds.hold(self.buyer, self.pot.pk, 2)
+
+        pot.price = Decimal('12.00')
+        pot.count = 6
+        pot.save()
+        self.pot.refresh_from_db()
+        self.assertEqual((self.pot.price, self.pot.count, self.pot.reserved), (Decimal('12.00'), 6, 2))
+
+    def test_purchase_holds(self):
+        holds.hold(self.buyer, self.pot.pk, 2)
+        holds.hold(self.buyer, self.pot.pk, 1)
+        holds.hold(self.other, self.pot.pk, 1)
+
+        purchases = holds.purchase(self.buyer)
+
+        self.assertEqual([(purchase.product, purchase.count) for purchase in purchases], [(self.pot, 3)])
+        self.pot.refresh_from_db()
+        self.assertEqual((self.pot.count, self.pot.reserved), (2, 1))
+        self.assertEqual(models.Profile.objects.get(user=self.buyer).cash, Decimal('970.00'))
+        self.assertEqual(list(models.StockHold.objects.values_list('user', flat=True)), [self.other.pk])
+        self.assertFalse(ledger.mismatches(models.Product).exists())
+        self.assertEqual(holds.purchase(self.buyer), [])
+
+    def test_expire_in_batches(self):
+        short = [holds.hold(user, self.pot.pk, 1) for user in (self.buyer, self.other) for _ in range(2)]
+        holds.hold(self.buyer, self.pot.pk, 1)
+        models.StockHold.objects.filter(pk__in=[hold.pk for hold in short]).update(expires=timezone.now())
+
+        self.assertEqual(holds.purchase(self.other), [])  # too late
+        with self.assertNumQueries(2 * 7 + 1):  # per batch one Product update whatever the holds
+            self.assertEqual(holds.expire(batch_size=2), 4)
+
+        self.pot.refresh_from_db()
+        self.assertEqual((self.pot.count, self.pot.reserved), (5, 1))
+        self.assertEqual(models.StockHold.objects.get().count, 1)
+
+    def test_views(self):
+        self.client.force_login(self.buyer)
+        self.client.post(f'/hold_create/{self.pot.pk}/', {'count': 2})
+        self.client.post(f'/hold_create/{self.pot.pk}/', {'count': 9})
+
+        response = self.client.get('/hold_list/')
+        self.assertEqual([hold.count for hold in response.context['holds']], [2])
+        self.assertContains(response, 'is not in stock. Now available 3')
+
+        self.client.post('/hold_list/', {'action': 'buy', 'holds': [response.context['holds'][0].pk]})
+        self.assertEqual(models.Purchase.objects.get().count, 2)
+        self.assertFalse(models.StockHold.objects.exists())
+
+
+@override_settings(SHOP_DB_REPLICAS=['replica1'])
+class ReplicaRouterTest(TransactionTestCase):
+    """ a second SQLite file stands in for the replica """
+
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        connections.databases['replica1'] = dict(connections.databases[DEFAULT_DB_ALIAS],
+                                                 NAME=os.path.join(self.tmp.name, 'replica.sqlite3'))
+
+    def tearDown(self):
+        connections['replica1'].close()
+        del connections['replica1']
+        del connections.databases['replica1']
+        self.tmp.cleanup()
+
+    def purchases(self):
+        return len(self.client.get('/purchase_list/').context['purchases'])
+
+    def test_reads_replica_until_own_write(self):
+        product = create_product(count=10)
+        call_command('sync_sqlite_replica', verbosity=0)
+        # the login is newer than the replica, auth reads stay on the primary
+        buyer = create_buyer('user1')
+        self.client.force_login(buyer)
+        checkout.purchase(buyer, product.pk, 1)
+
+        self.assertEqual(self.purchases(), 0)
+        self.assertTrue(routers.reading_primary())  # reset once the page is rendered
+        self.client.post(f'/purchase_create/{product.pk}/', {'count': 1})
+        self.assertEqual(self.purchases(), 2)  # sticky primary after the write
+
+        session = self.client.session
+        session[routers.SESSION_KEY] = 0
+        session.save()
+        self.assertEqual(self.purchases(), 0)
+        call_command('sync_sqlite_replica', verbosity=0)
+        self.assertEqual(self.purchases(), 2)
+
+    def test_writes_and_locks_go_to_primary(self):
+        product = create_product()
+        call_command('sync_sqlite_replica', verbosity=0)
+        request = RequestFactory().get('/')
+
+        with routers.replica_reads(request) as alias:
+            self.assertEqual(alias, 'replica1')
+            self.assertEqual(models.Product.objects.db, 'replica1')
+            self.assertEqual(models.Product.objects.select_for_update().db, DEFAULT_DB_ALIAS)
+            self.assertEqual(User.objects.db, DEFAULT_DB_ALIAS)
+            product.count = 7
+            product.save()
+        self.assertEqual(models.Product.objects.get().count, 7)
+        self.assertEqual(models.Product.objects.using('replica1').get().count, 5)
+
+    def test_search_reads_replica(self):
+        create_product(name='kettle')
+        call_command('sync_sqlite_replica', verbosity=0)
+        create_product(name='kettle lid')
+
+        with routers.replica_reads(RequestFactory().get('/search/')):
+            self.assertEqual(search.search('kettle').count(), 1)
+            self.assertEqual(search.facets('kettle')['total'], 1)
+        self.assertEqual(search.search('kettle').count(), 2)
+        self.assertEqual(search.facets('kettle')['total'], 2)
+
+
+class CopyShopDataTest(TransactionTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        connections.databases['copy'] = dict(connections.databases[DEFAULT_DB_ALIAS],
+                                             NAME=os.path.join(self.tmp.name, 'copy.sqlite3'))
+        call_command('migrate', database='copy', verbosity=0)
+
+    def tearDown(self):
+        connections['copy'].close()
+        del connections['copy']
+        del connections.databases['copy']
+        self.tmp.cleanup()
+
+    def test_every_model_is_copied(self):
+        product = create_product(count=10)
+        buyer = create_buyer('user1')
+        checkout.purchase(buyer, product.pk, 1, idempotency_key='a' * 32)
+        holds.hold(buyer, product.pk, 2)
+        returns.request(models.Purchase.objects.get())
+
+        call_command('copy_shop_data', source=DEFAULT_DB_ALIAS, target='copy', stdout=StringIO())
+
+        for model in copy_shop_data.MODELS:
+            self.assertTrue(model.objects.using('copy').exists(), model)
+            self.assertEqual(model.objects.using('copy').count(), model.objects.count(), model)
+        self.assertEqual(models.IdempotencyKey.objects.using('copy').get().created,
+                         models.IdempotencyKey.objects.get().created)
+
+
+class SqliteTuningTest(TestCase):
+
+    def journal_mode(self, name):
+        wrapper = connections[DEFAULT_DB_ALIAS].__class__(dict(connection.settings_dict, NAME=name), alias='tuning')
+        try:
+            with wrapper.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                return cursor.fetchone()[0]
+        finally:
+            wrapper.close()
+
+    def test_wal_only_when_enabled(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('sqlite only')
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(self.journal_mode(os.path.join(tmp, 'default.sqlite3')), 'delete')
+            with override_settings(SHOP_SQLITE_WAL=True):
+                self.assertEqual(self.journal_mode(os.path.join(tmp, 'wal.sqlite3')), 'wal')
+
+
+class SessionStorageTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = create_product()
+        self.buyer = create_buyer('user1')
+
+    def session_queries(self, path, data=None):
+        with CaptureQueriesContext(connection) as context:
+            if data is None:
+                response = self.client.get(path)
+            else:
+                response = self.client.post(path, data, follow=True)
+        return response, [query['sql'] for query in context.captured_queries if 'django_session' in query['sql']]
+
+    def test_no_session_table_reads(self):
+        for engine in ('cached_db', 'cache', 'signed_cookies'):
+            with self.subTest(engine), self.settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+                self.client = self.client_class()  # SessionMiddleware keeps the engine it started with
+                self.client.force_login(self.buyer)
+
+                response, queries = self.session_queries('/purchase_list/')
+                self.assertEqual(response.context['user'], self.buyer)
+                self.assertEqual(queries, [])
+
+                # message written on the POST, shown after the redirect, kept in a cookie
+                response, queries = self.session_queries(f'/purchase_create/{self.product.pk}/', {'count': 1})
+                self.assertEqual([str(message) for message in response.context['messages']],
+                                 ['Success purchase: pot (1) total cost 10.00'])
+                self.assertEqual(queries, [])
+
+
+class CursorPaginationTest(TestCase):
+
+    def test_walk_forward_and_back(self):
+        for price in [3, 1, 2, 2, 5, 4, 2, 6, 7, 8, 9]:
+            create_product(price=Decimal(price))
+        expected = list(models.Product.objects.order_by('price', 'pk').values_list('pk', flat=True))
+
+        response = self.client.get('/')
+        seen = [product.pk for product in response.context['products']]
+        cursor = response.context['cursor_next']
+        pages = []
+        while cursor:
+            response = self.client.get('/', {'cursor': cursor})
+            pages.append(response)
+            self.assertIsNone(response.context['paginator'])
+            seen += [product.pk for product in response.context['products']]
+            cursor = response.context['cursor_next']
+        self.assertEqual(seen, expected)
+
+        response = self.client.get('/', {'cursor': pages[-1].context['cursor_prev']})
+        self.assertEqual([product.pk for product in response.context['products']], expected[:8])
+        self.assertIsNone(response.context['cursor_prev'])
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get('/', {'cursor': 'garbage'}).status_code, 404)
+
+
+class CatalogueCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = create_product(count=5)
+
+    def test_anonymous_hits_no_database(self):
+        self.client.get('/')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertContains(response, 'cooking pot')
+
+    def test_cards_per_role(self):
+        buyer = create_buyer('user1')
+        self.client.force_login(buyer)
+        response = self.client.get('/')
+        self.assertContains(response, f'/purchase_create/{self.product.pk}/')
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+        self.assertNotContains(response, catalogue.CSRF_PLACEHOLDER)
+
+        self.client.logout()
+        self.assertNotContains(self.client.get('/'), f'/purchase_create/{self.product.pk}/')
+
+    def test_product_save_invalidates_page(self):
+        self.client.get('/')
+        create_product(name='kettle')
+        self.assertContains(self.client.get('/'), 'kettle')
+
+
+@override_settings(SHOP_IMAGE_SYNC=True)
+class CatalogueInvalidationTest(TransactionTestCase):
+    """ checkout invalidates cached cards on commit """
+
+    def test_purchase_invalidates_stock(self):
+        cache.clear()
+        product = create_product(count=5)
+        buyer = create_buyer('user1')
+        self.client.get('/')
+
+        checkout.purchase(buyer, product.pk, 2)
+        response = self.client.get('/')
+        self.assertContains(response, '<span class="in-stock">3</span>', html=True)
+
+
+class ProductSearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.pot = create_product(name='Cooking pot', description='steel', price=Decimal('45.00'))
+        self.pan = create_product(name='Frying pan', description='for a cooking plate', price=Decimal('5.00'))
+        self.lid = create_product(name='Potlid', description='glass', price=Decimal('150.00'), count=0)
+
+    def test_prefix_and_rank(self):
+        self.assertEqual(list(search.search('cook')), [self.pot, self.pan])  # name match first
+        self.assertCountEqual(search.search('pot'), [self.pot, self.lid])
+        self.assertEqual(list(search.search('COOKING fry')), [self.pan])
+        self.assertCountEqual(search.search('"pot*'), [self.pot, self.lid])  # no match syntax injection
+
+    def test_index_follows_product_changes(self):
+        self.pan.name = 'Wok'
+        self.pan.save()
+        self.pot.delete()
+
+        self.assertEqual(list(search.search('fry')), [])
+        self.assertEqual(list(search.search('wok')), [self.pan])
+        self.assertEqual(list(search.search('cook')), [self.pan])
+
+    def test_facets(self):
+        self.assertEqual(search.facets('pot'), {'total': 2, 'in_stock': 1, 'price': {
+            'under-10': 0, '10-50': 1, '50-100': 0, 'over-100': 1}})
+        self.assertEqual(list(search.narrow(search.search('pot'), 'over-100')), [self.lid])
+        self.assertEqual(list(search.narrow(search.search(''), in_stock=True)), [self.pan, self.pot])
+
+        self.lid.count = 3
+        self.lid.save()
+        self.assertEqual(search.facets('pot')['in_stock'], 2)
+
+    def test_search_page(self):
+        response = self.client.get('/search/', {'q': 'pot', 'in_stock': 'on'})
+
+        self.assertEqual([card.pk for card in response.context['products']], [self.pot.pk])
+        self.assertEqual(response.context['in_stock_facet'], (1, 'q=pot', True))
+        self.assertContains(response, 'over 100 ₴ (1)')
+        self.assertEqual(self.client.get('/search/', {'price': 'bogus'}).status_code, 200)
+
+        # slice and facets cached, until a product changes
+        with self.assertNumQueries(0):
+            self.client.get('/search/', {'q': 'pot', 'in_stock': 'on'})
+        self.lid.count = 1
+        self.lid.save()
+        response = self.client.get('/search/', {'q': 'pot', 'in_stock': 'on'})
+        self.assertEqual(len(response.context['products']), 2)
+
+
+class CartCheckoutTest(TestCase):
+
+    def setUp(self):
+        self.pot = create_product(count=5)
+        self.kettle = create_product(name='kettle', count=2, price=Decimal('20.00'))
+        self.buyer = create_buyer('user1', cash=Decimal('100.00'))
+
+    def test_checkout_many_lines(self):
+        with self.assertNumQueries(11):
+            purchases = checkout.purchase_many(self.buyer, [(self.pot.pk, 2), (self.kettle.pk, 1),
+                                                            (self.pot.pk, 1)])
+
+        self.assertEqual(len(purchases), 2)
+        self.assertEqual(models.Purchase.objects.count(), 2)
+        self.assertEqual(models.Product.objects.get(pk=self.pot.pk).count, 2)
+        self.assertEqual(models.Product.objects.get(pk=self.kettle.pk).count, 1)
+        self.assertEqual(models.Profile.objects.get(user=self.buyer).cash, Decimal('50.00'))
+
+    def test_one_sold_out_line_rolls_back_cart(self):
+        with self.assertRaises(checkout.SoldOut) as error:
+            checkout.purchase_many(self.buyer, [(self.pot.pk, 1), (self.kettle.pk, 3)])
+
+        self.assertEqual(error.exception.product.pk, self.kettle.pk)
+        self.assertEqual(models.Product.objects.get(pk=self.pot.pk).count, 5)
+        self.assertFalse(models.Purchase.objects.exists())
+
+    def test_cart_view(self):
+        self.client.force_login(self.buyer)
+        response = self.client.post('/purchase_cart/', {'product': [self.pot.pk, self.kettle.pk],
+                                                        'count': [1, 2]})
+
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertEqual(models.Purchase.objects.count(), 2)
+
+    def test_cart_view_rejects_bad_lines(self):
+        self.client.force_login(self.buyer)
+        self.client.post('/purchase_cart/', {'product': [self.pot.pk], 'count': [0]})
+        self.assertFalse(models.Purchase.objects.exists())
+
+
+class ReturnBatchTest(TestCase):
+
+    def setUp(self):
+        self.pot = create_product(count=20)
+        self.kettle = create_product(name='kettle', count=20, price=Decimal('5.00'))
+        self.buyers = [create_buyer(f'user{n}', cash=Decimal('1000.00')) for n in range(3)]
+        self.purchases = []
+        for buyer in self.buyers:
+            for product in (self.pot, self.kettle):
+                purchase = checkout.purchase(buyer, product.pk, 2)
+                self.purchases.append(models.Purchase.objects.get(buyer=buyer, product=product))
+        for purchase in self.purchases:
+            returns.request(purchase)
+
+    def test_approve_in_constant_queries(self):
+        with self.assertNumQueries(14):
+            rows = returns.approve([purchase.pk for purchase in self.purchases])
+
+        self.assertEqual(len(rows), 6)
+        self.assertFalse(models.Purchase.objects.exists())
+        self.assertFalse(models.Return.objects.exists())
+        self.assertEqual(models.Product.objects.get(pk=self.pot.pk).count, 20)
+        self.assertEqual(models.Product.objects.get(pk=self.kettle.pk).count, 20)
+        for profile in models.Profile.objects.all():
+            self.assertEqual(profile.cash, Decimal('1000.00'))
+
+    def test_reject(self):
+        rows = returns.reject([self.purchases[0].pk])
+
+        self.assertEqual(len(rows), 1)
+        self.assertFalse(models.Purchase.objects.get(pk=self.purchases[0].pk).return_status)
+        self.assertEqual(models.Return.objects.count(), 5)
+
+    def test_bulk_action_view(self):
+        admin = User.objects.create_superuser('admin', 'admin@shop.com', '1')
+        self.client.force_login(admin)
+        pks = [purchase.pk for purchase in self.purchases[:4]]
+
+        response = self.client.post('/return_list/', {'action': 'approve', 'returns': pks})
+        self.assertRedirects(response, '/return_list/', fetch_redirect_response=False)
+        self.assertEqual(models.Purchase.objects.count(), 2)
+
+    def test_single_return_views(self):
+        admin = User.objects.create_superuser('admin', 'admin@shop.com', '1')
+        self.client.force_login(admin)
+
+        self.client.post(f'/purchase_delete/{self.purchases[0].pk}/')
+        self.client.post(f'/return_delete/{self.purchases[1].pk}/')
+        self.assertEqual(models.Purchase.objects.count(), 5)
+        self.assertEqual(models.Return.objects.count(), 4)
+
+
+class ReturnStressTest(TransactionTestCase):
+    """ admins approve the same returns at once. On sqlite the test runs on a
+    file: the shared in-memory test database fails lock waits at once """
+
+    threads = 4
+
+    def setUp(self):
+        self.memory = connections[DEFAULT_DB_ALIAS]
+        if connection.vendor == 'sqlite':
+            self.tmp = tempfile.TemporaryDirectory()
+            self.addCleanup(self.tmp.cleanup)
+            self.use_file()
+            call_command('migrate', verbosity=0)
+
+    def tearDown(self):
+        if connections[DEFAULT_DB_ALIAS] is not self.memory:
+            connections[DEFAULT_DB_ALIAS].close()
+            connections[DEFAULT_DB_ALIAS] = self.memory
+
+    def use_file(self):
+        if self.memory.vendor == 'sqlite':
+            name = os.path.join(self.tmp.name, 'returns.sqlite3')
+            connections[DEFAULT_DB_ALIAS] = self.memory.__class__(dict(self.memory.settings_dict, NAME=name),
+                                                                  DEFAULT_DB_ALIAS)
+
+    def test_concurrent_approvals(self):
+        product = create_product(count=20)
+        buyers = [create_buyer(f'user{n}') for n in range(self.threads)]
+        for buyer in buyers:
+            checkout.purchase(buyer, product.pk, 2)
+        for purchase in models.Purchase.objects.all():
+            returns.request(purchase)
+        pks = [purchase.pk for purchase in models.Purchase.objects.all()]
+        barrier = threading.Barrier(self.threads)
+        approved, errors = [], []
+
+        def approve():
+            self.use_file()
+            barrier.wait()
+            try:
+                approved.append(len(returns.approve(pks)))
+            except OperationalError as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=approve) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(approved), [0] * (self.threads - 1) + [self.threads])
+        self.assertEqual(models.Product.objects.get().count, 20)
+        for profile in models.Profile.objects.all():
+            self.assertEqual(profile.cash, Decimal('1000.00'))
+        self.assertFalse(ledger.mismatches(models.Profile).exists())
+
+
+class DailyStatsTest(TestCase):
+
+    def setUp(self):
+        self.pot = create_product(count=20)
+        self.buyer = create_buyer('user1')
+        checkout.purchase(self.buyer, self.pot.pk, 2)
+        checkout.purchase(self.buyer, self.pot.pk, 3)
+        self.purchases = list(models.Purchase.objects.order_by('pk'))
+        for purchase in self.purchases:
+            returns.request(purchase)
+
+    def test_sales_refunds_and_rejections(self):
+        returns.approve([self.purchases[0].pk])
+        returns.reject([self.purchases[1].pk])
+
+        product = models.DailyProductStats.objects.get(product=self.pot, day=timezone.localdate())
+        self.assertEqual((product.units_sold, product.revenue), (5, Decimal('50.00')))
+        self.assertEqual((product.units_returned, product.refunds), (2, Decimal('20.00')))
+        self.assertEqual(product.returns_rejected, 1)
+        buyer = models.DailyBuyerStats.objects.get(buyer=self.buyer)
+        self.assertEqual((buyer.purchases, buyer.spent, buyer.refunded), (2, Decimal('50.00'), Decimal('20.00')))
+
+    def test_backfill_matches_live_rollups(self):
+        live = list(models.DailyProductStats.objects.values('day', 'product_id', 'units_sold', 'revenue'))
+        models.DailyProductStats.objects.all().delete()
+        models.DailyBuyerStats.objects.all().delete()
+
+        self.assertEqual(list(stats.backfill(chunk_size=1)), [1, 2])
+        self.assertEqual(list(models.DailyProductStats.objects.values('day', 'product_id', 'units_sold', 'revenue')),
+                         live)
+        self.assertEqual(models.DailyBuyerStats.objects.get().purchases, 2)
+
+    def test_analytics_view(self):
+        self.assertRedirects(self.client.get('/analytics/'), '/user_login/?next=/analytics/')
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@shop.com', '1'))
+        response = self.client.get('/analytics/?days=7')
+        self.assertEqual(response.context['totals']['units_sold'], 5)
+        self.assertContains(response, 'user1')
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        pot = create_product(count=20)
+        for username in ('user1', 'user2'):
+            buyer = create_buyer(username)
+            for _ in range(3):
+                checkout.purchase(buyer, pot.pk, 1)
+        returns.request(models.Purchase.objects.first())
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@shop.com', '1'))
+
+    def test_csv_filtered_by_buyer(self):
+        response = self.client.get('/export/purchases/', {'buyer': 'user1', 'since': timezone.localdate()})
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['purchase_id', 'time', 'buyer_id', 'username'])
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(all(',user1,' in line for line in lines[1:]))
+
+    def test_rows_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = list(export.rows('purchases', chunk_size=2))
+        self.assertEqual(len(rows), 6)
+
+    def test_jsonl_returns(self):
+        response = self.client.get('/export/returns/', {'format': 'jsonl'})
+
+        row, = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual((row['username'], row['count'], row['price']), ('user1', 1, '10.00'))
+
+    def test_bad_range(self):
+        response = self.client.get('/export/purchases/', {'since': '2020-02-01', 'until': '2020-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AdminTest(TestCase):
+
+    def setUp(self):
+        self.pot = create_product(count=20)
+        self.buyers = [create_buyer(f'user{n}') for n in range(3)]
+        for buyer in self.buyers:
+            checkout.purchase(buyer, self.pot.pk, 2)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@shop.com', '1'))
+
+    def test_changelists_do_not_query_per_row(self):
+        for purchase in models.Purchase.objects.all():
+            returns.request(purchase)
+        urls = ('/admin/shop/purchase/', '/admin/shop/return/', '/admin/shop/profile/')
+        queries = {}
+        for url in urls:
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            queries[url] = len(captured)
+
+        for buyer in [create_buyer(f'more{n}') for n in range(5)]:
+            checkout.purchase(buyer, self.pot.pk, 1)
+            returns.request(models.Purchase.objects.get(buyer=buyer))
+        for url in urls:
+            with self.assertNumQueries(queries[url]):
+                self.client.get(url)
+
+    def test_refund_action(self):
+        returns.request(models.Purchase.objects.first())
+        response = self.client.post('/admin/shop/purchase/', {
+            'action': 'refund',
+            '_selected_action': list(models.Purchase.objects.values_list('pk', flat=True)),
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(models.Purchase.objects.exists())
+        self.assertEqual(models.Product.objects.get().count, 20)
+        self.assertEqual(list(models.Profile.objects.filter(user__in=self.buyers)
+                              .values_list('pending_returns', 'cash').distinct()),
+                         [(0, Decimal('1000.00'))])
+
+    def test_restock_action(self):
+        self.client.post('/admin/shop/product/', {'action': 'restock_10', '_selected_action': [self.pot.pk]})
+        self.assertEqual(models.Product.objects.get().count, 24)
+
+
+class ProductFormTest(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@shop.com', '1'))
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def test_create(self):
+        self.assertContains(self.client.get('/product_create/'), 'name="return_window"')
+        response = self.client.post('/product_create/', {
+            'name': 'kettle', 'description': 'electric kettle', 'price': '25.00', 'count': 3,
+            'return_window': '00:10:00', 'photo': SimpleUploadedFile('kettle.svg', b'<svg></svg>')})
+
+        self.assertRedirects(response, '/product_create/', fetch_redirect_response=False)
+        product = models.Product.objects.get(name='kettle')
+        self.assertEqual(product.return_window, timedelta(minutes=10))
+
+    def test_update(self):
+        product = create_product()
+        self.assertContains(self.client.get(f'/product_update/{product.pk}/'), 'name="return_window"')
+        response = self.client.post(f'/product_update/{product.pk}/', {
+            'name': 'pot', 'description': 'cooking pot', 'price': '12.50', 'count': 7,
+            'return_window': '00:03:00'})
+
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        product.refresh_from_db()
+        self.assertEqual((product.price, product.count), (Decimal('12.50'), 7))
+
+
+class ReturnCreateTest(TestCase):
+
+    def setUp(self):
+        product = create_product()
+        self.buyer = create_buyer('user1')
+        checkout.purchase(self.buyer, product.pk, 1)
+        self.purchase = models.Purchase.objects.get()
+        self.client.force_login(self.buyer)
+
+    def test_return_in_one_lookup(self):
+        with self.assertNumQueries(7):
+            self.client.post('/return_create/', {'purchase': self.purchase.pk})
+        self.assertTrue(models.Return.objects.filter(pk=self.purchase.pk).exists())
+
+        self.client.post('/return_create/', {'purchase': self.purchase.pk})
+        self.assertEqual(models.Return.objects.count(), 1)
+
+    def test_time_over(self):
+        models.Purchase.objects.update(return_deadline=timezone.now() - timedelta(seconds=1))
+        self.client.post('/return_create/', {'purchase': self.purchase.pk})
+        self.assertFalse(models.Return.objects.exists())
+
+    def test_window_per_product(self):
+        kettle = create_product(name='kettle', return_window=timedelta(days=14))
+        checkout.purchase(self.buyer, kettle.pk, 1)
+
+        purchase = models.Purchase.objects.get(product=kettle)
+        self.assertAlmostEqual(purchase.return_deadline - purchase.time, timedelta(days=14), delta=timedelta(seconds=1))
+
+    def test_foreign_purchase(self):
+        self.client.force_login(create_buyer('user2'))
+        self.client.post('/return_create/', {'purchase': self.purchase.pk})
+        self.assertFalse(models.Return.objects.exists())
+
+
+class ReturnExpiryTest(TestCase):
+
+    def setUp(self):
+        self.pot = create_product(count=20)
+        self.buyer = create_buyer('user1')
+        for _ in range(5):
+            checkout.purchase(self.buyer, self.pot.pk, 1)
+        self.purchases = list(models.Purchase.objects.order_by('pk'))
+
+    def test_expire_in_batches(self):
+        returns.request(self.purchases[0])
+        returns.reject([self.purchases[0].pk])
+        returns.request(self.purchases[1])
+        later = timezone.now() + timedelta(minutes=4)
+
+        with self.assertNumQueries(5):
+            self.assertEqual(returns.expire(batch_size=2, now=later), 3)
+        self.assertEqual(list(models.Purchase.objects.order_by('pk').values_list('return_state', flat=True)),
+                         ['rejected', 'requested', 'expired', 'expired', 'expired'])
+        self.assertEqual(returns.expire(now=later), 0)
+
+    def test_purchase_list_by_state(self):
+        returns.request(self.purchases[0])
+        self.client.force_login(self.buyer)
+
+        response = self.client.get('/purchase_list/', {'return_state': 'requested'})
+        self.assertEqual([purchase.pk for purchase in response.context['purchases']], [self.purchases[0].pk])
+        self.assertContains(response, 'Return request sent')
+
+
+class IdempotencyTest(TestCase):
+
+    def setUp(self):
+        self.pot = create_product(count=5)
+        self.buyer = create_buyer('user1')
+        self.client.force_login(self.buyer)
+
+    def test_double_submit_buys_once(self):
+        for _ in range(2):
+            self.client.post(f'/purchase_create/{self.pot.pk}/', {'count': 2, 'idempotency_key': 'k1'})
+        self.client.post(f'/purchase_create/{self.pot.pk}/', {'count': 1}, HTTP_IDEMPOTENCY_KEY='k2')
+
+        self.assertEqual(models.Purchase.objects.count(), 2)
+        self.assertEqual(models.Product.objects.get().count, 2)
+        self.assertEqual(models.Profile.objects.get(user=self.buyer).cash, Decimal('970.00'))
+
+    def test_failed_purchase_frees_key(self):
+        with self.assertRaises(checkout.SoldOut):
+            checkout.purchase(self.buyer, self.pot.pk, 6, idempotency_key='k1')
+        checkout.purchase(self.buyer, self.pot.pk, 5, idempotency_key='k1')
+
+        with self.assertRaises(idempotency.AlreadyProcessed):
+            checkout.purchase(self.buyer, self.pot.pk, 5, idempotency_key='k1')
+
+    def test_purge(self):
+        checkout.purchase(self.buyer, self.pot.pk, 1, idempotency_key='old')
+        checkout.purchase(self.buyer, self.pot.pk, 1, idempotency_key='new')
+        models.IdempotencyKey.objects.filter(key='old').update(created=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(idempotency.purge(ttl=24 * 60 * 60), 1)
+        self.assertEqual(list(models.IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+
+class LedgerTest(TestCase):
+
+    def setUp(self):
+        self.pot = create_product(count=20)
+        self.buyer = create_buyer('user1')
+
+    def test_balances_match_events(self):
+        checkout.purchase(self.buyer, self.pot.pk, 3)
+        returns.refund(list(models.Purchase.objects.values_list('pk', flat=True)))
+        checkout.purchase(self.buyer, self.pot.pk, 2)
+        self.pot.refresh_from_db()
+        self.pot.count = 50
+        self.pot.save()
+
+        self.assertFalse(ledger.mismatches(models.Product).exists())
+        self.assertFalse(ledger.mismatches(models.Profile).exists())
+        self.assertEqual(list(models.LedgerEvent.objects.filter(product=self.pot)
+                              .values_list('kind', 'stock_delta').order_by('pk')),
+                         [('adjust', 20), ('purchase', -3), ('refund', 3), ('purchase', -2), ('adjust', 32)])
+
+    def test_adjustment_without_select(self):
+        pot = models.Product.objects.get(pk=self.pot.pk)
+        pot.count = 25
+        with CaptureQueriesContext(connection) as queries:
+            pot.save()
+        pot.count = 24
+        pot.save()
+
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith('SELECT') and 'shop_product' in query['sql']])
+        self.assertEqual(list(models.LedgerEvent.objects.filter(product=self.pot)
+                              .values_list('stock_delta', flat=True).order_by('pk')), [20, 5, -1])
+
+        deferred = models.Product.objects.only('name').get(pk=self.pot.pk)
+        deferred.count = 30
+        deferred.save()
+        self.assertFalse(ledger.mismatches(models.Product).exists())
+
+    def test_rebuild(self):
+        models.Product.objects.update(count=7)
+
+        with self.assertRaises(CommandError):
+            call_command('audit_ledger', stdout=StringIO())
+        call_command('audit_ledger', rebuild=True, stdout=StringIO())
+        self.assertEqual(models.Product.objects.get().count, 20)
+
+    def test_rebuild_drops_cached_balance(self):
+        cache.clear()
+        models.Profile.objects.filter(user=self.buyer).update(cash=Decimal('5.00'))
+        self.assertEqual(account.summary(self.buyer.pk)['cash'], Decimal('5.00'))
+
+        call_command('audit_ledger', rebuild=True, stdout=StringIO())
+        self.assertEqual(account.summary(self.buyer.pk)['cash'], Decimal('1000.00'))
+
+
+class AccountSummaryTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = create_product()
+        self.buyer = create_buyer('user1', cash=Decimal('100.00'))
+        self.client.force_login(self.buyer)
+
+    def test_summary_follows_purchase_return_and_refund(self):
+        checkout.purchase(self.buyer, self.product.pk, 2)
+        checkout.purchase(self.buyer, self.product.pk, 1)
+        self.assertEqual(account.summary(self.buyer.pk), {
+            'cash': Decimal('70.00'), 'purchase_count': 2,
+            'total_spent': Decimal('30.00'), 'pending_returns': 0})
+
+        purchase = models.Purchase.objects.filter(count=2).get()
+        self.client.post('/return_create/', {'purchase': purchase.pk})
+        self.assertEqual(account.summary(self.buyer.pk)['pending_returns'], 1)
+
+        returns.approve([purchase.pk])
+        self.assertEqual(account.summary(self.buyer.pk), {
+            'cash': Decimal('90.00'), 'purchase_count': 1,
+            'total_spent': Decimal('10.00'), 'pending_returns': 0})
+
+    def test_widget_costs_no_query_when_cached(self):
+        self.client.get('/purchase_list/')
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/purchase_list/')
+        self.assertContains(response, 'You cash <br> 100 ₴')
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        registry.reset()
+
+    def test_views_are_measured(self):
+        self.client.get('/')
+        snapshot = registry.snapshot()['views']['shop:index']
+
+        self.assertEqual(snapshot['view_seconds']['count'], 1)
+        self.assertEqual(snapshot['render_seconds']['count'], 1)
+        self.assertGreater(snapshot['render_seconds']['sum'], 0)
+        self.assertGreater(snapshot['response_bytes']['sum'], 0)
+
+    @override_settings(SHOP_METRICS_TOKEN='secret')
+    def test_endpoint(self):
+        self.client.get('/')
+        self.assertEqual(self.client.get('/metrics/').status_code, 302)
+
+        response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertContains(response, 'shop_view_seconds_count{view="shop:index"} 1')
+
+    @override_settings(SHOP_QUERY_BUDGET=1)
+    def test_query_budget(self):
+        self.client.force_login(create_buyer('user1'))
+
+        with self.assertLogs('shop.metrics', 'WARNING'):
+            self.client.get('/purchase_list/')
+        self.assertEqual(registry.snapshot()['over_budget'], {'shop:purchase_list': 1})
+
+
+@override_settings(SHOP_IMAGE_SYNC=True)
+class ImageVariantsTest(TransactionTestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def test_raster_photo_gets_variants(self):
+        photo = BytesIO()
+        Image.new('RGB', (1200, 900), 'red').save(photo, 'PNG')
+        product = create_product(photo=SimpleUploadedFile('pot.png', photo.getvalue()))
+
+        product.refresh_from_db()
+        self.assertRegex(product.photo_card.name, r'variants/pot\.\w{12}\.card\.jpg$')
+        with Image.open(product.photo_thumb.path) as thumb:
+            self.assertEqual(thumb.size, (96, 72))
+        self.assertTrue(product.photo_webp.name.endswith('.webp'))
+
+    def test_svg_is_kept(self):
+        product = create_product(photo=SimpleUploadedFile('pot.svg', b'<svg></svg>'))
+
+        product.refresh_from_db()
+        self.assertEqual(product.photo_card.name, '')
+
+    def test_only_photo_changes_are_processed(self):
+        product = create_product(photo=SimpleUploadedFile('pot.svg', b'<svg></svg>'))
+        product = models.Product.objects.get(pk=product.pk)
+
+        with mock.patch('shop.images.schedule') as schedule:
+            product.price = Decimal('12.00')
+            product.count = 4
+            product.save()
+            models.Product.objects.get(pk=product.pk).save()
+            schedule.assert_not_called()
+
+            product.photo = SimpleUploadedFile('lid.svg', b'<svg></svg>')
+            product.save()
+            schedule.assert_called_once_with(product.pk)
+
+
+class ASGIHandlerTest(TransactionTestCase):
+
+    def request(self, method, path, body=b'', headers=()):
+        handler = asgi.ASGIHandler(get_wsgi_application(), workers=2)
+        chunks = [{'type': 'http.request', 'body': body[:10], 'more_body': True},
+                  {'type': 'http.request', 'body': body[10:], 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return chunks.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'path': path, 'query_string': b'', 'method': method,
+                 'headers': [(b'host', b'testserver')] + list(headers)}
+        try:
+            asyncio.run(handler(scope, receive, send))
+        finally:
+            handler.executor.shutdown()
+        return sent[0], b''.join(message.get('body', b'') for message in sent[1:])
+
+    def test_get(self):
+        create_product(name='asgi pot')
+
+        start, body = self.request('GET', '/')
+        self.assertEqual(start['status'], 200)
+        self.assertIn(b'asgi pot', body)
+
+    def test_post_body_in_chunks(self):
+        create_buyer('buyer')
+        token = 'a' * 64
+        form = f'username=buyer&password=1&csrfmiddlewaretoken={token}'.encode()
+
+        start, body = self.request('POST', '/user_login/', form, [
+            (b'cookie', f'csrftoken={token}'.encode()),
+            (b'content-type', b'application/x-www-form-urlencoded'),
+            (b'content-length', str(len(form)).encode()),
+        ])
+        self.assertEqual(start['status'], 302)
+        self.assertIn(b'sessionid', b' '.join(value for name, value in start['headers']))
+
+
+class AssetServeTest(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        with open(os.path.join(self.root.name, 'style.0123456789ab.css'), 'wb') as css:
+            css.write(b'body {}' * 100)
+        with open(os.path.join(self.root.name, 'style.0123456789ab.css.gz'), 'wb') as css:
+            css.write(gzip.compress(b'body {}' * 100))
+        self.factory = RequestFactory()
+
+    def serve(self, **headers):
+        request = self.factory.get('/static/style.0123456789ab.css', **headers)
+        return assets.serve(request, 'style.0123456789ab.css', self.root.name)
+
+    def test_hashed_file_is_immutable(self):
+        response = self.serve()
+        self.assertEqual(response['Cache-Control'], assets.IMMUTABLE)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_precompressed_copy(self):
+        response = self.serve(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'body {}' * 100)
+
+    def test_brotli_copy_preferred(self):
+        with open(os.path.join(self.root.name, 'style.0123456789ab.css.br'), 'wb') as css:
+            css.write(b'brotli body')
+
+        response = self.serve(HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(b''.join(response.streaming_content), b'brotli body')
+        self.assertEqual(self.serve(HTTP_ACCEPT_ENCODING='gzip')['Content-Encoding'], 'gzip')
+
+    def test_if_none_match(self):
+        etag = self.serve()['ETag']
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_outside_root(self):
+        request = self.factory.get('/static/../settings.py')
+        with self.assertRaises(Http404):
+            assets.serve(request, '../settings.py', self.root.name)
+
+
+class ProductionMediaTest(TestCase):
+    """ SHOP_ASSETS=production serves media through assets.serve, DEBUG as in base.settings """
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        for name in ('pot.0123456789ab.card.jpg', 'pot.svg'):
+            with open(os.path.join(self.media.name, name), 'wb') as photo:
+                photo.write(b'photo')
+        with override_settings(SHOP_ASSETS='production', MEDIA_ROOT=self.media.name, DEBUG=True):
+            importlib.reload(base_urls)
+        clear_url_caches()
+        self.addCleanup(clear_url_caches)
+        self.addCleanup(importlib.reload, base_urls)
+
+    def test_media_caching_headers(self):
+        response = self.client.get('/media/pot.0123456789ab.card.jpg')
+        self.assertEqual(response['Cache-Control'], assets.IMMUTABLE)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertEqual(b''.join(response.streaming_content), b'photo')
+
+        response = self.client.get('/media/pot.svg')
+        self.assertEqual(response['Cache-Control'], assets.REVALIDATE)
+        self.assertEqual(self.client.get('/media/pot.svg', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+@skipUnless(storage.brotli, 'brotli is not installed')
+class CompressedStorageTest(TestCase):
+
+    def test_collectstatic_copies(self):
+        source, target = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.addCleanup(target.cleanup)
+        with open(os.path.join(source.name, 'style.css'), 'wb') as css:
+            css.write(b'body { color: black; }' * 100)
+        static = storage.CompressedManifestStaticFilesStorage(location=target.name, base_url='/static/')
+
+        processed = list(static.post_process({'style.css': (FileSystemStorage(source.name), 'style.css')}))
+
+        hashed_name = processed[0][1]
+        with open(os.path.join(target.name, hashed_name + '.br'), 'rb') as css:
+            self.assertEqual(storage.brotli.decompress(css.read()), b'body { color: black; }' * 100)
+        with open(os.path.join(target.name, hashed_name + '.gz'), 'rb') as css:
+            self.assertEqual(gzip.decompress(css.read()), b'body { color: black; }' * 100)
+
+        response = assets.serve(RequestFactory().get('/static/' + hashed_name, HTTP_ACCEPT_ENCODING='br'),
+                                hashed_name, target.name)
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(storage.brotli.decompress(b''.join(response.streaming_content)),
+                         b'body { color: black; }' * 100)
+
+
+class RowTagsTest(TestCase):
+
+    def setUp(self):
+        self.product = create_product(count=10)
+        self.buyer = create_buyer('user1')
+        checkout.purchase(self.buyer, self.product.pk, 1)
+        self.purchase = models.Purchase.objects.get()
+
+    def test_url_matches_reverse(self):
+        self.assertEqual(shop_tags.url('shop:return_delete', 7), '/return_delete/7/')
+        self.assertEqual(shop_tags.url('shop:return_create'), '/return_create/')
+        set_script_prefix('/shop/')
+        self.addCleanup(set_script_prefix, '/')
+        self.assertEqual(shop_tags.url('shop:return_delete', 42), '/shop/return_delete/42/')
+
+    def test_return_list_row_forms(self):
+        returns.request(self.purchase)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@shop.com', '1'))
+
+        response = self.client.get('/return_list/?page=1')
+
+        self.assertContains(response, f'action="/purchase_delete/{self.purchase.pk}/"')
+        self.assertContains(response, f'action="/return_delete/{self.purchase.pk}/"')
+        self.assertContains(response, 'name="success_url" value="/return_list/?page=1"')
+        # both row forms and the bulk form
+        self.assertContains(response, 'name="csrfmiddlewaretoken"', count=3)
+        self.assertContains(response, shop_tags.alt_image())
+
+    def test_purchase_list_row_form(self):
+        self.client.force_login(self.buyer)
+
+        response = self.client.get('/purchase_list/')
+
+        self.assertContains(response, 'action="/return_create/"')
+        self.assertContains(response, f'name="purchase" value="{self.purchase.pk}"')
+        self.assertContains(response, 'name="csrfmiddlewaretoken"', count=1)
+
+    def test_render_bench(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'results.json')
+            call_command('shop_render_bench', rows=3, repeat=1, output=output, stdout=StringIO())
+            with open(output) as results:
+                pages = json.load(results)['pages']
+        self.assertIn('return_list@production', pages)
+        self.assertEqual(len(pages), 8)
+
+
+class UserProvisioningTest(TestCase):
+
+    def test_login_leaves_profile_alone(self):
+        create_buyer('user1')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.client.login(username='user1', password='1'))
+
+        self.assertFalse([query for query in queries if 'shop_profile' in query['sql']])
+
+    def test_signup_hashes_password_once(self):
+        with mock.patch('django.contrib.auth.base_user.check_password') as check_password:
+            response = self.client.post('/user_create/', {
+                'username': 'user1', 'password1': 'long enough 1', 'password2': 'long enough 1'})
+
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        check_password.assert_not_called()
+        user = User.objects.get(username='user1')
+        self.assertEqual(self.client.session['_auth_user_id'], str(user.pk))
+        self.assertEqual(user.profile.cash, Decimal('10000.00'))
+
+    def test_provision_users(self):
+        create_buyer('user1')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'accounts.csv')
+            with open(path, 'w') as accounts:
+                accounts.write('username,email,cash\n'
+                               'user1,user1@corp.com,\n'
+                               'user2,user2@corp.com,250.50\n'
+                               'user3,,\n')
+            out = StringIO()
+            call_command('provision_users', path, password='start', cash=Decimal('100'), stdout=out)
+
+        self.assertIn('2 users created', out.getvalue())
+        self.assertIn('1 existing users skipped: user1', out.getvalue())
+        user2 = User.objects.get(username='user2')
+        self.assertEqual(user2.email, 'user2@corp.com')
+        self.assertTrue(user2.check_password('start'))
+        self.assertEqual(user2.profile.cash, Decimal('250.50'))
+        self.assertEqual(User.objects.get(username='user3').profile.cash, Decimal('100.00'))
+        self.assertEqual(models.Profile.objects.get(user__username='user1').cash, Decimal('1000.00'))
+        self.assertEqual(models.LedgerEvent.objects.filter(kind=models.LedgerEvent.OPENING).count(), 2)
+        self.assertFalse(ledger.mismatches(models.Profile).exists())
+
+    def test_provision_queries_per_batch(self):
+        # five statements in a savepoint, whatever the batch size
+        with self.assertNumQueries(7):
+            created, _ = provisioning.provision((f'user{n}', '', None) for n in range(50))
+
+        self.assertEqual(created, 50)
+        self.assertFalse(User.objects.get(username='user7').has_usable_password())
+
+    def test_provision_users_rejects_bad_rows(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'accounts.csv')
+            with open(path, 'w') as accounts:
+                accounts.write('username,email\nuser1,\nuser1,\n')
+            with self.assertRaisesMessage(CommandError, 'line 3: username "user1" repeats'):
+                call_command('provision_users', path, stdout=StringIO())
+        self.assertFalse(User.objects.exists())
@@ -1,23 +1,32 @@
-from django.urls import path, include
-from .views import ProductList, UserCreate, UserLogin, UserLogout, ProductCreate, ProductUpdate
-from .views import PurchaseCreate, PurchaseDelete, PurchaseList
+from django.urls import path, re_path, include
+from .views import ProductList, ProductSearch, UserCreate, UserLogin, UserLogout, ProductCreate, ProductUpdate
+from .views import HoldCreate, HoldList
+from .views import PurchaseCreate, PurchaseCart, PurchaseDelete, PurchaseList
 from .views import ReturnList, ReturnDelete, ReturnCreate
+from .views import Analytics, Export, Metrics
 
 
 app_name = 'shop'
 
 urlpatterns = [
     path('', ProductList.as_view(), name='index'),
+    path('search/', ProductSearch.as_view(), name='search'),
     path('user_create/', UserCreate.as_view(), name='user_create'),
     path('user_login/', UserLogin.as_view(), name='user_login'),
     path('user_logout/', UserLogout.as_view(), name='user_logout'),
     path('product_create/', ProductCreate.as_view(), name='product_create'),
     path('product_update/<int:pk>/', ProductUpdate.as_view(), name='product_update'),
     path('purchase_create/<int:pk>/', PurchaseCreate.as_view(), name='purchase_create'),
+    path('purchase_cart/', PurchaseCart.as_view(), name='purchase_cart'),
+    path('hold_create/<int:pk>/', HoldCreate.as_view(), name='hold_create'),
+    path('hold_list/', HoldList.as_view(), name='hold_list'),
     path('purchase_list/', PurchaseList.as_view(), name='purchase_list'),
     path('purchase_delete/<int:pk>/', PurchaseDelete.as_view(), name='purchase_delete'),
     path('return_list/', ReturnList.as_view(), name='return_list'),
     path('return_create/', ReturnCreate.as_view(), name='return_create'),
     path('return_delete/<int:pk>/', ReturnDelete.as_view(), name='return_delete'),
+    path('analytics/', Analytics.as_view(), name='analytics'),
+    re_path(r'^export/(?P<kind>purchases|returns)/$', Export.as_view(), name='export'),
+    path('metrics/', Metrics.as_view(), name='metrics'),
 ]
 
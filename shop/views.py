@@ -1,18 +1,34 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import login
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib.auth.views import LoginView, LogoutView, redirect_to_login
-from django.views.generic.base import View
+from django.views.generic.base import TemplateView, View
 from django.views.generic.list import ListView
-from django.views.generic.edit import CreateView, DeleteView, UpdateView, FormMixin
+from django.views.generic.edit import CreateView, DeleteView, UpdateView, FormMixin, FormView
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
-from django.db.models import ExpressionWrapper, F, DecimalField
+from django.db import IntegrityError
+from django.db.models import ExpressionWrapper, F, DecimalField, Sum
 from django.urls import reverse_lazy, reverse
 from datetime import timedelta
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 
+from shop import catalogue
+from shop import checkout
+from shop import export
+from shop import holds
+from shop import idempotency
 from shop import models
+from shop import returns
+from shop import search
+from shop.metrics import registry
+from shop import routers
+from shop.routers import ReplicaReads
+from shop.pagination import CursorPage, CursorPaginator, InvalidCursor
 from shop import forms
 
 
@@ -53,7 +69,45 @@ class CustomSuccessUrl:
         return self.success_url
 
 
-class ProductList(ListView):
+class CursorPagination:
+    """ mixin for opt-in keyset pagination: '?cursor=<token>' instead of '?page=N'.
+    Shallow pages keep the default paginator. Ordering must end with 'pk' """
+
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        paginator = CursorPaginator(queryset, page_size, self.get_ordering())
+
+        if cursor is None:
+            page_data = super().paginate_queryset(queryset, page_size)
+            page = page_data[1]
+            self.cursor_next = paginator.encode(list(page)[-1], 'next') if page.has_next() else None
+            self.cursor_prev = None
+            return page_data
+
+        try:
+            page = paginator.page(cursor)
+        except InvalidCursor as error:
+            raise Http404(str(error))
+
+        self.cursor_next, self.cursor_prev = page.next_cursor, page.prev_cursor
+        return None, page, page.object_list, False
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # filters of the page, kept by the cursor links
+        query = self.request.GET.copy()
+        for kwarg in (self.cursor_kwarg, self.page_kwarg):
+            query.pop(kwarg, None)
+        context.update({'cursor_next': getattr(self, 'cursor_next', None),
+                        'cursor_prev': getattr(self, 'cursor_prev', None),
+                        'cursor_kwarg': self.cursor_kwarg,
+                        'cursor_query': query.urlencode() + '&' if query else ''})
+        return context
+
+
+class ProductList(ReplicaReads, CursorPagination, ListView):
     """ home page '/' """
 
     template_name = 'shop/product/index.html'
@@ -61,7 +115,39 @@ class ProductList(ListView):
     queryset = model.objects.all()
     context_object_name = 'products'
     paginate_by = 8
-    ordering = 'price'
+    ordering = ('price', 'pk')
+
+    def paginate_queryset(self, queryset, page_size):
+        """ page slices and rendered cards come from catalogue cache """
+
+        key = catalogue.page_key(self.request.GET.get(self.page_kwarg, 1),
+                                 self.request.GET.get(self.cursor_kwarg, ''))
+        data = catalogue.get_page(key)
+
+        if data is None:
+            paginator, page, products, is_paginated = super().paginate_queryset(queryset, page_size)
+            products = list(products)
+            data = {'pks': [product.pk for product in products],
+                    'count': paginator.count if paginator else None,
+                    'number': page.number if paginator else None,
+                    'cursor_next': self.cursor_next,
+                    'cursor_prev': self.cursor_prev}
+            catalogue.set_page(key, data)
+        elif data['count'] is None:
+            products = None
+            self.cursor_next, self.cursor_prev = data['cursor_next'], data['cursor_prev']
+            paginator, page = None, CursorPage([], self.cursor_next, self.cursor_prev)
+        else:
+            products = None
+            self.cursor_next, self.cursor_prev = data['cursor_next'], data['cursor_prev']
+            paginator = self.get_paginator(range(data['count']), page_size,
+                                           orphans=self.get_paginate_orphans(),
+                                           allow_empty_first_page=self.get_allow_empty())
+            page = paginator.page(data['number'])
+
+        page.object_list = catalogue.cards(self.request, data['pks'], products)
+        is_paginated = paginator is not None and page.has_other_pages()
+        return paginator, page, page.object_list, is_paginated
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -69,6 +155,69 @@ class ProductList(ListView):
         return context
 
 
+class ProductSearch(ReplicaReads, ListView):
+    """ search page '/search/?q=pot&price=10-50&in_stock=on', best matches first """
+
+    template_name = 'shop/product/search.html'
+    context_object_name = 'products'
+    paginate_by = 8
+
+    def get(self, request, *args, **kwargs):
+        self.form = forms.ProductSearchForm(request.GET)
+        self.filters = self.form.cleaned_data if self.form.is_valid() else {'q': '', 'price': '', 'in_stock': False}
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return search.narrow(search.search(self.filters['q']), self.filters['price'], self.filters['in_stock'])
+
+    def paginate_queryset(self, queryset, page_size):
+        """ ranked page slices come from catalogue cache, broad words rank most of the table """
+
+        key = catalogue.page_key('search', self.filters['price'], self.filters['in_stock'],
+                                 self.request.GET.get(self.page_kwarg, 1), *search.terms(self.filters['q']))
+        data = catalogue.get_page(key)
+
+        if data is None:
+            paginator, page, products, is_paginated = super().paginate_queryset(queryset, page_size)
+            products = list(products)
+            data = {'pks': [product.pk for product in products], 'count': paginator.count, 'number': page.number}
+            catalogue.set_page(key, data)
+        else:
+            products = None
+            paginator = self.get_paginator(range(data['count']), page_size,
+                                           orphans=self.get_paginate_orphans(),
+                                           allow_empty_first_page=self.get_allow_empty())
+            page = paginator.page(data['number'])
+
+        page.object_list = catalogue.cards(self.request, data['pks'], products)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def facet_link(self, name, value, selected):
+        """ query string selecting value of facet name, or dropping it when selected """
+
+        query = self.request.GET.copy()
+        query.pop(self.page_kwarg, None)
+        if selected:
+            query.pop(name, None)
+        else:
+            query[name] = value
+        return query.urlencode()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        counts = search.facets(self.filters['q'])
+        context.update({
+            'search_form': self.form,
+            'facet_total': counts['total'],
+            'price_facets': [(label, counts['price'][key], self.facet_link('price', key, selected), selected)
+                             for key, (label, _, _) in search.PRICE_RANGES.items()
+                             for selected in [self.filters['price'] == key]],
+            'in_stock_facet': (counts['in_stock'], self.facet_link('in_stock', 'on', self.filters['in_stock']),
+                               self.filters['in_stock']),
+        })
+        return context
+
+
 class UserCreate(CreateView):
     """ create user form page '/user_create/' """
 
@@ -79,10 +228,8 @@ class UserCreate(CreateView):
 
     def form_valid(self, form):
         data = super().form_valid(form)
-        username = self.request.POST['username']
-        password = self.request.POST['password1']
-        user = authenticate(username=username, password=password)
-        login(self.request, user)
+        # the password was just hashed by save(), authenticate() would hash it again
+        login(self.request, self.object, backend=settings.AUTHENTICATION_BACKENDS[0])
         return data
 
 
@@ -134,56 +281,157 @@ class PurchaseCreate(UserAccess, CustomSuccessUrl, CreateView):
     form_class = forms.PurchaseCreateForm
     model = models.Purchase
 
-    def purchase_validator(self, form):
-        error_check = False
-        user = models.Profile.objects.get(pk=self.request.user.pk)
-        product = models.Product.objects.get(pk=self.kwargs['pk'])
+    def form_valid(self, form):
         ordered_product = form.cleaned_data.get('count')
-        total_cost = ordered_product * product.price
 
-        if product.count < ordered_product:
-            error_check = True
+        try:
+            purchase = checkout.purchase(self.request.user, self.kwargs['pk'], ordered_product,
+                                         idempotency.request_key(self.request))
+        except idempotency.AlreadyProcessed:
+            messages.add_message(self.request, messages.INFO, 'This purchase is already done')
+            return redirect(self.success_url)
+        except models.Product.DoesNotExist as error:
+            messages.add_message(self.request, messages.WARNING, str(error))
+            return redirect(self.success_url)
+        except checkout.SoldOut as error:
             messages.add_message(self.request, messages.WARNING,
-                                 f'{product.name} ({ordered_product}) is not in stock. '
-                                 f'Now available {product.count}')
-
-        if total_cost >= user.cash:
-            error_check = True
+                                 f'{error.product.name} ({ordered_product}) is not in stock. '
+                                 f'Now available {error.product.available}')
+            return redirect(self.success_url)
+        except checkout.InsufficientFunds as error:
             messages.add_message(self.request, messages.WARNING,
-                                 f'You need {total_cost.normalize()} ₴ '
-                                 f'for buy {product.name} ({ordered_product})')
+                                 f'You need {error.total_cost.normalize()} ₴ '
+                                 f'for buy {error.product.name} ({ordered_product})')
+            return redirect(self.success_url)
 
-        return {'error_check': error_check,
-                'total_cost': total_cost,
-                'user': user,
-                'product': product,
-                'ordered_product': ordered_product,
-                }
+        messages.add_message(
+            self.request, messages.SUCCESS,
+            f"Success purchase: {purchase.product.name} ({purchase.count}) "
+            f"total cost {purchase.product.price * purchase.count}")
 
-    def form_valid(self, form):
-        valid_data = self.purchase_validator(form)
+        self.object = purchase
+        return HttpResponseRedirect(self.get_success_url())
 
-        if valid_data['error_check']:
+
+class PurchaseCart(UserAccess, CustomSuccessUrl, FormView):
+    """ cart checkout '/purchase_cart/'. Many products in one POST """
+
+    template_name = 'shop/purchase/create.html'
+    success_url = '/'
+    form_class = forms.CartCheckoutForm
+    http_method_names = ['post']
+
+    def form_valid(self, form):
+        try:
+            purchases = checkout.purchase_many(self.request.user, form.cleaned_data['lines'],
+                                               idempotency.request_key(self.request))
+        except idempotency.AlreadyProcessed:
+            messages.add_message(self.request, messages.INFO, 'This purchase is already done')
+            return redirect(self.success_url)
+        except models.Product.DoesNotExist as error:
+            messages.add_message(self.request, messages.WARNING, str(error))
+            return redirect(self.success_url)
+        except checkout.SoldOut as error:
+            messages.add_message(self.request, messages.WARNING,
+                                 f'{error.product.name} ({error.count}) is not in stock. '
+                                 f'Now available {error.product.available}')
+            return redirect(self.success_url)
+        except checkout.InsufficientFunds as error:
+            messages.add_message(self.request, messages.WARNING,
+                                 f'You need {error.total_cost.normalize()} ₴ for buy this cart')
             return redirect(self.success_url)
 
-        valid_data['user'].cash -= valid_data['total_cost']
-        valid_data['user'].save()
-        valid_data['product'].count -= valid_data['ordered_product']
-        valid_data['product'].save()
+        total_cost = sum(purchase.product.price * purchase.count for purchase in purchases)
+        messages.add_message(
+            self.request, messages.SUCCESS,
+            f"Success purchase: {', '.join(f'{p.product.name} ({p.count})' for p in purchases)} "
+            f"total cost {total_cost}")
+        return HttpResponseRedirect(self.get_success_url())
+
+    def form_invalid(self, form):
+        for error in form.non_field_errors():
+            messages.add_message(self.request, messages.WARNING, error)
+        return redirect(self.success_url)
+
+
+class HoldCreate(UserAccess, CustomSuccessUrl, FormView):
+    """ cart hold page '/' button 'Hold'. Keeps count items for the buyer a while """
+
+    template_name = 'shop/purchase/create.html'
+    success_url = '/'
+    form_class = forms.PurchaseCreateForm
+    http_method_names = ['post']
+
+    def form_valid(self, form):
+        count = form.cleaned_data.get('count')
+        try:
+            stock_hold = holds.hold(self.request.user, self.kwargs['pk'], count)
+        except models.Product.DoesNotExist as error:
+            messages.add_message(self.request, messages.WARNING, str(error))
+            return redirect(self.success_url)
+        except checkout.SoldOut as error:
+            messages.add_message(self.request, messages.WARNING,
+                                 f'{error.product.name} ({count}) is not in stock. '
+                                 f'Now available {error.product.available}')
+            return redirect(self.success_url)
 
         messages.add_message(
             self.request, messages.SUCCESS,
-            f"Success purchase: {valid_data['product'].name} ({valid_data['ordered_product']}) "
-            f"total cost {valid_data['total_cost']}")
+            f"{stock_hold.product.name} ({count}) is held for you "
+            f"till {timezone.localtime(stock_hold.expires):%H:%M:%S}")
+        return HttpResponseRedirect(self.get_success_url())
 
-        form_add = form.save(commit=False)
-        form_add.buyer_id = self.request.user.pk
-        form_add.product_id = self.kwargs['pk']
-        form.cleaned_data.update({'product': form.instance.product.name})
-        return super().form_valid(form)
+    def form_invalid(self, form):
+        messages.add_message(self.request, messages.WARNING, 'Count must be positive')
+        return redirect(self.success_url)
+
+
+class HoldList(UserAccess, ListView):
+    """ buyer cart holds page '/hold_list/', buttons 'Buy selected' / 'Cancel selected' """
 
+    template_name = 'shop/hold/list.html'
+    context_object_name = 'holds'
 
-class PurchaseList(UserAccess, FormMixin, ListView):
+    def get_queryset(self):
+        return (models.StockHold.objects
+                .filter(user=self.request.user, expires__gt=timezone.now())
+                .select_related('product')
+                .annotate(total=ExpressionWrapper(F('count') * F('product__price'),
+                                                  output_field=DecimalField()))
+                .order_by('expires', 'pk'))
+
+    def post(self, request, *args, **kwargs):
+        selected = [int(pk) for pk in request.POST.getlist('holds') if pk.isdigit()]
+        action = request.POST.get('action')
+
+        if action == 'buy':
+            try:
+                purchases = holds.purchase(request.user, selected, idempotency.request_key(request))
+            except idempotency.AlreadyProcessed:
+                messages.add_message(request, messages.INFO, 'This purchase is already done')
+            except models.Product.DoesNotExist as error:
+                messages.add_message(request, messages.WARNING, str(error))
+            except checkout.SoldOut as error:
+                messages.add_message(request, messages.WARNING,
+                                     f'{error.product.name} ({error.count}) is not in stock anymore')
+            except checkout.InsufficientFunds as error:
+                messages.add_message(request, messages.WARNING,
+                                     f'You need {error.total_cost.normalize()} ₴ for buy this cart')
+            else:
+                messages.add_message(
+                    request, messages.SUCCESS,
+                    f"Success purchase: {', '.join(f'{p.product.name} ({p.count})' for p in purchases)} "
+                    f"total cost {sum(p.product.price * p.count for p in purchases)}"
+                    if purchases else 'No holds left, they have expired')
+        elif action == 'cancel':
+            rows = holds.cancel(request.user, selected)
+            messages.add_message(request, messages.SUCCESS, f'{len(rows)} holds cancelled')
+        else:
+            messages.add_message(request, messages.WARNING, 'Unknown action')
+        return redirect(reverse('shop:hold_list'))
+
+
+class PurchaseList(UserAccess, ReplicaReads, CursorPagination, FormMixin, ListView):
     """ Purchase list page '/purchase_list/' """
 
     template_name = 'shop/purchase/list.html'
@@ -191,19 +439,24 @@ class PurchaseList(UserAccess, FormMixin, ListView):
     model = models.Purchase
     context_object_name = 'purchases'
     paginate_by = 6
-    ordering = '-time'
+    ordering = ('-time', '-pk')
     page_kwarg = 'page'
     form_class = forms.ReturnCreateForm
 
     def get_queryset(self):
         qs = super().get_queryset()
-        qs = qs.annotate(post_time=F('purchase__post_time'))
+        qs = qs.filter(buyer=self.request.user).select_related('product')
+        return_state = self.request.GET.get('return_state')
+        if return_state in dict(models.Purchase.RETURN_STATES):
+            qs = qs.filter(return_state=return_state)
+        qs = qs.annotate(
+            total=ExpressionWrapper(F('count') * F('product__price'), output_field=DecimalField()))
         return qs
 
     def get_context_data(self, **kwargs):
-        time_over = timezone.now() - timedelta(minutes=3)
         context = super().get_context_data(**kwargs)
-        context.update({'time_over': time_over})
+        # returnable rows past the deadline until the expiry job gets to them
+        context.update({'now': timezone.now(), 'return_states': models.Purchase.RETURN_STATES})
         return context
 
 
@@ -216,45 +469,46 @@ class PurchaseDelete(AdminAccess, DeleteView):
     model = models.Purchase
 
     def delete(self, request, *args, **kwargs):
-        purchase = self.model.objects.get(pk=kwargs['pk'])
-        total_cost = purchase.product.price * purchase.count
-
-        purchase.buyer.profile.cash += total_cost
-        purchase.buyer.profile.save()
-        purchase.product.count += purchase.count
-        purchase.product.save()
+        for row in returns.approve([kwargs['pk']]):
+            messages.add_message(self.request, messages.SUCCESS,
+                                 f'Return in store {row["product_name"]} ({row["count"]}) confirmed. '
+                                 f'Return {row["username"]} {row["total"]} ₴')
+        return redirect(self.success_url)
 
-        messages.add_message(self.request, messages.SUCCESS,
-                             f'Return in store {purchase.product.name} ({purchase.count}) confirmed. '
-                             f'Return {purchase.buyer.username} {purchase.count * purchase.product.price} ₴')
-        return super().delete(request, *args, **kwargs)
 
-
-class ReturnCreate(UserAccess, CustomSuccessUrl, CreateView):
+class ReturnCreate(UserAccess, CustomSuccessUrl, FormView):
     """ create return form page '/purchase_list/' button 'Return product' """
 
     template_name = 'shop/return/create.html'
     success_url = '/purchase_list/'
     form_class = forms.ReturnCreateForm
+    http_method_names = ['post']
 
-    @staticmethod
-    def return_validator(form):
-        time_over = form.cleaned_data['purchase'].time + timedelta(minutes=3)
-        if time_over < timezone.now():
-            return True
-        return False
+    def get_purchase(self, pk):
+        """ own purchase still in return window, with product, or None """
+
+        return (models.Purchase.objects
+                .select_related('product')
+                .filter(pk=pk, buyer=self.request.user, return_state=models.Purchase.RETURNABLE,
+                        return_deadline__gt=timezone.now())
+                .first())
 
     def form_valid(self, form):
+        purchase = self.get_purchase(form.cleaned_data['purchase'])
 
-        if self.return_validator(form):
+        if purchase is None:
             messages.add_message(self.request, messages.WARNING, 'Return time is over')
             return redirect(self.get_success_url())
 
-        purchase = form.cleaned_data["purchase"]
+        try:
+            returns.request(purchase, idempotency.request_key(self.request))
+        except (IntegrityError, idempotency.AlreadyProcessed):
+            return self.form_invalid(form)
+
         messages.add_message(self.request, messages.SUCCESS,
                              f'You have return: {purchase.product.name} ({purchase.count}) '
                              f'buy: {purchase.time.strftime("%Y-%m-%d %H:%M:%S")}')
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
 
     def form_invalid(self, form):
         messages.add_message(self.request, messages.WARNING,
@@ -262,14 +516,14 @@ class ReturnCreate(UserAccess, CustomSuccessUrl, CreateView):
         return redirect(self.get_success_url())
 
 
-class ReturnList(AdminAccess, ListView):
+class ReturnList(AdminAccess, ReplicaReads, CursorPagination, ListView):
     """ List users return page '/return_list/' """
 
     template_name = 'shop/return/list.html'
     model = models.Return
     context_object_name = 'returns'
     paginate_by = 6
-    ordering = 'post_time'
+    ordering = ('post_time', 'pk')
     page_kwarg = 'page'
 
     def setup(self, request, *args, **kwargs):
@@ -278,11 +532,67 @@ class ReturnList(AdminAccess, ListView):
 
     def get_queryset(self):
         qs = super().get_queryset()
+        qs = qs.select_related('purchase__buyer', 'purchase__product')
         qs = qs.annotate(total=ExpressionWrapper(
             F('purchase__count') * F('purchase__product__price'),
             output_field=DecimalField()))
         return qs
 
+    def post(self, request, *args, **kwargs):
+        """ bulk buttons 'Return selected' / 'No return selected' """
+
+        selected = [int(pk) for pk in request.POST.getlist('returns') if pk.isdigit()]
+        action = request.POST.get('action')
+
+        if action == 'approve':
+            rows = returns.approve(selected)
+            messages.add_message(request, messages.SUCCESS,
+                                 f'Return in store confirmed: {len(rows)} purchases. '
+                                 f'Return {sum(row["total"] for row in rows)} ₴')
+        elif action == 'reject':
+            rows = returns.reject(selected)
+            messages.add_message(request, messages.SUCCESS,
+                                 f'{len(rows)} purchases left with the buyers')
+        else:
+            messages.add_message(request, messages.WARNING, 'Unknown action')
+        return redirect(request.META.get('HTTP_REFERER') or reverse('shop:return_list'))
+
+
+class Analytics(AdminAccess, ReplicaReads, TemplateView):
+    """ sales of the last '?days=N' days page '/analytics/', reads only the daily rollups """
+
+    template_name = 'shop/analytics/index.html'
+    default_days = 30
+    max_days = 366
+    top = 10
+
+    def get_days(self):
+        days = self.request.GET.get('days', '')
+        return min(int(days), self.max_days) if days.isdigit() and int(days) else self.default_days
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        days = self.get_days()
+        since = timezone.localdate() - timedelta(days=days - 1)
+        product_stats = models.DailyProductStats.objects.filter(day__gte=since)
+        buyer_stats = models.DailyBuyerStats.objects.filter(day__gte=since)
+        sums = {'units_sold': Sum('units_sold'), 'revenue': Sum('revenue'),
+                'units_returned': Sum('units_returned'), 'refunds': Sum('refunds'),
+                'returns_rejected': Sum('returns_rejected')}
+
+        context.update(
+            days=days,
+            since=since,
+            totals=product_stats.aggregate(**sums),
+            daily=product_stats.values('day').annotate(**sums).order_by('-day'),
+            top_products=(product_stats.values('product_id', 'product__name').annotate(**sums)
+                          .order_by('-revenue')[:self.top]),
+            top_buyers=(buyer_stats.values('buyer_id', 'buyer__username')
+                        .annotate(purchases=Sum('purchases'), spent=Sum('spent'), refunded=Sum('refunded'))
+                        .order_by('-spent')[:self.top]),
+        )
+        return context
+
 
 class ReturnDelete(AdminAccess, DeleteView):
     """ reject user return. Page '/return_list/' button 'No return' """
@@ -292,9 +602,41 @@ class ReturnDelete(AdminAccess, DeleteView):
     success_url = '/return_list/'
 
     def delete(self, request, *args, **kwargs):
-        qs = self.model.objects.get(pk=kwargs['pk']).purchase
-        qs.return_status = False
-        qs.save()
-        messages.add_message(self.request, messages.SUCCESS,
-                             f'{qs.product.name} ({qs.count}) left with the buyer')
-        return super().delete(request, *args, **kwargs)
+        for row in returns.reject([kwargs['pk']]):
+            messages.add_message(self.request, messages.SUCCESS,
+                                 f'{row["product_name"]} ({row["count"]}) left with the buyer')
+        return redirect(self.success_url)
+
+
+class Export(AdminAccess, View):
+    """ streaming export page '/export/<purchases|returns>/', filters in ExportForm """
+
+    def get(self, request, *args, kind, **kwargs):
+        form = forms.ExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text(), content_type='text/plain')
+
+        filters = form.cleaned_data.copy()
+        export_format = filters.pop('format')
+        response = StreamingHttpResponse(export.lines(kind, export_format, using=routers.read_alias(request),
+                                                      **filters),
+                                         content_type=f'{export.FORMATS[export_format]}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{export_format}"'
+        return response
+
+
+class Metrics(AdminAccess, View):
+    """ per view metrics '/metrics/'. Prometheus text, '?format=json' for JSON.
+    Scrapers authenticate with 'Authorization: Bearer <SHOP_METRICS_TOKEN>' """
+
+    def test_func(self):
+        token = getattr(settings, 'SHOP_METRICS_TOKEN', None)
+        if token and constant_time_compare(self.request.META.get('HTTP_AUTHORIZATION', ''),
+                                           f'Bearer {token}'):
+            return True
+        return super().test_func()
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('format') == 'json':
+            return JsonResponse(registry.snapshot())
+        return HttpResponse(registry.prometheus(), content_type='text/plain; version=0.0.4')